@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import sys
+
+from deploy_app import get_session
+
+# Load through the app's own writer, so the benchmark measures the layout forecast runs produce
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import forecast_logic
+
+# --- CONFIGURATION ---
+CLUSTERED_TABLE = "AIDOPS_BENCH_CLUSTERED"
+UNCLUSTERED_TABLE = "AIDOPS_BENCH_UNCLUSTERED"
+MAX_SCAN_FRACTION = 0.10 # A one-item lookup must touch at most this share of micro-partitions
+
+# Same shape as core.FORECAST_RESULTS, generated in random order
+GENERATE_SQL = """
+SELECT
+    DATEADD(day, d.day_no, '2015-01-01'::DATE) AS DATE,
+    'ITEM_' || LPAD(i.item_no, 5, '0') AS ITEM_NAME,
+    UNIFORM(0, 200, RANDOM()) AS QUANTITY_USED,
+    UNIFORM(0, 200, RANDOM())::FLOAT AS FORECAST_NEXT_7_DAYS,
+    UNIFORM(-50, 5000, RANDOM()) AS STOCK_REMAINING,
+    'MA7' AS FORECAST_METHOD,
+    'REGION_' || MOD(i.item_no, 8) AS REGION
+FROM (SELECT SEQ4() AS item_no FROM TABLE(GENERATOR(ROWCOUNT => {items}))) i
+CROSS JOIN (SELECT SEQ4() AS day_no FROM TABLE(GENERATOR(ROWCOUNT => {days}))) d
+ORDER BY RANDOM()
+"""
+
+
+def scan_stats(session, query):
+    """Runs `query` and returns (partitions scanned, partitions total) of its table scan."""
+    session.sql(query).collect()
+    query_id = session.sql("SELECT LAST_QUERY_ID() AS QID").collect()[0]["QID"]
+    rows = session.sql(f"""
+        SELECT OPERATOR_STATISTICS
+        FROM TABLE(GET_QUERY_OPERATOR_STATS('{query_id}'))
+        WHERE OPERATOR_TYPE = 'TableScan'
+    """).collect()
+    pruning = json.loads(rows[0]["OPERATOR_STATISTICS"]).get("pruning", {})
+    return pruning.get("partitions_scanned", 0), pruning.get("partitions_total", 0)
+
+
+def benchmark(items, days):
+    session, _ = get_session()
+
+    try:
+        # Measure the storage layout, not the result cache
+        session.sql("ALTER SESSION SET USE_CACHED_RESULT = FALSE").collect()
+
+        print(f"🏗️  Generating {items * days:,} rows ({items} items x {days} days)...")
+        generated = GENERATE_SQL.format(items=items, days=days)
+        # Clustered: an existing, empty clustered table refreshed by forecast_logic.replace_table_contents,
+        # exactly like core.FORECAST_RESULTS after install
+        session.sql(f"CREATE OR REPLACE TRANSIENT TABLE {CLUSTERED_TABLE} CLUSTER BY (ITEM_NAME, DATE) "
+                    f"AS SELECT * FROM ({generated}) LIMIT 0").collect()
+        forecast_logic.replace_table_contents(session, session.sql(generated), CLUSTERED_TABLE, ["ITEM_NAME", "DATE"])
+        # Unclustered: the same rows in arrival (random) order
+        session.sql(f"CREATE OR REPLACE TRANSIENT TABLE {UNCLUSTERED_TABLE} AS {generated}").collect()
+
+        probe_item = f"ITEM_{items // 2:05d}"
+        queries = {
+            "Point lookup (1 item)": "SELECT * FROM {table} WHERE ITEM_NAME = '" + probe_item + "'",
+            "Item + 90-day range": "SELECT * FROM {table} WHERE ITEM_NAME = '" + probe_item + "'"
+                                   f" AND DATE >= DATEADD(day, {max(days - 90, 0)}, '2015-01-01'::DATE)",
+        }
+
+        failed = False
+        print(f"\n{'Query':<24}{'Layout':<14}{'Scanned':>10}{'Total':>10}{'Fraction':>10}")
+        for label, template in queries.items():
+            for layout, table in [("clustered", CLUSTERED_TABLE), ("unclustered", UNCLUSTERED_TABLE)]:
+                scanned, total = scan_stats(session, template.format(table=table))
+                fraction = scanned / total if total else 0.0
+                print(f"{label:<24}{layout:<14}{scanned:>10}{total:>10}{fraction:>10.1%}")
+                if layout == "clustered" and fraction > MAX_SCAN_FRACTION:
+                    failed = True
+
+        if failed:
+            print(f"\n❌ Clustered lookups scanned more than {MAX_SCAN_FRACTION:.0%} of partitions.")
+        else:
+            print(f"\n✅ Clustered lookups stay under {MAX_SCAN_FRACTION:.0%} of partitions.")
+        return not failed
+
+    finally:
+        for table in (CLUSTERED_TABLE, UNCLUSTERED_TABLE):
+            session.sql(f"DROP TABLE IF EXISTS {table}").collect()
+        session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check micro-partition pruning for the (ITEM_NAME, DATE) layout.")
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=3650)
+    args = parser.parse_args()
+    sys.exit(0 if benchmark(args.items, args.days) else 1)
@@ -16,29 +16,206 @@ CREATE OR REPLACE PROCEDURE core.forecast_proc(
     input_table_name VARCHAR,
     date_col VARCHAR,
     item_col VARCHAR,
-    qty_col VARCHAR
+    qty_col VARCHAR,
+    method VARCHAR DEFAULT 'MA7', -- 'AUTO' = best backtested method per item
+    weather_table_name VARCHAR DEFAULT 'reference(''weather_table'')' -- Marketplace weather feed (manifest reference)
 )
 RETURNS VARCHAR
 LANGUAGE PYTHON
 RUNTIME_VERSION = '3.8'
 PACKAGES = ('snowflake-snowpark-python')
-IMPORTS = ('/src/forecast_logic.py') -- Path relative to app root
+IMPORTS = ('/src/forecast_logic.py', '/src/data_quality.py') -- Paths relative to app root
 HANDLER = 'forecast_logic.main';
 
-GRANT USAGE ON PROCEDURE core.forecast_proc(VARCHAR, VARCHAR, VARCHAR, VARCHAR) TO APPLICATION ROLE app_public;
+GRANT USAGE ON PROCEDURE core.forecast_proc(VARCHAR, VARCHAR, VARCHAR, VARCHAR, VARCHAR, VARCHAR) TO APPLICATION ROLE app_public;
+
+-- 3b. Register the Backtesting Procedure (rolling-origin accuracy per item, method and horizon)
+CREATE OR REPLACE PROCEDURE core.backtest_proc(
+    input_table_name VARCHAR,
+    date_col VARCHAR,
+    item_col VARCHAR,
+    qty_col VARCHAR,
+    horizon INTEGER DEFAULT 7,
+    n_origins INTEGER DEFAULT 56
+)
+RETURNS VARCHAR
+LANGUAGE PYTHON
+RUNTIME_VERSION = '3.8'
+PACKAGES = ('snowflake-snowpark-python')
+IMPORTS = ('/src/backtest.py', '/src/forecast_logic.py', '/src/data_quality.py')
+HANDLER = 'backtest.main';
+
+GRANT USAGE ON PROCEDURE core.backtest_proc(VARCHAR, VARCHAR, VARCHAR, VARCHAR, INTEGER, INTEGER) TO APPLICATION ROLE app_public;
+
+-- 3c. Register the Daily Briefing Procedure (one Cortex briefing per region and program, batched)
+CREATE OR REPLACE PROCEDURE core.daily_briefings_proc(
+    model VARCHAR DEFAULT 'mistral-large',
+    max_concurrency INTEGER DEFAULT 4
+)
+RETURNS VARCHAR
+LANGUAGE PYTHON
+RUNTIME_VERSION = '3.8'
+PACKAGES = ('snowflake-snowpark-python', 'pandas')
+IMPORTS = ('/src/briefings.py', '/src/forecast_logic.py', '/src/data_quality.py')
+HANDLER = 'briefings.main';
+
+GRANT USAGE ON PROCEDURE core.daily_briefings_proc(VARCHAR, INTEGER) TO APPLICATION ROLE app_public;
 
 -- 4. Create the Result Table (Empty initially)
 -- This allows us to grant SELECT on it to the app role.
-CREATE OR REPLACE TABLE core.FORECAST_RESULTS (
+-- Created once: forecast runs swap its rows with INSERT OVERWRITE, so the table, its grant and
+-- its clustering survive every refresh and upgrade.
+-- Clustered on (ITEM_NAME, DATE) so per-item charts and date-range filters prune micro-partitions.
+CREATE TABLE IF NOT EXISTS core.FORECAST_RESULTS (
     DATE DATE,
     ITEM_NAME VARCHAR,
     QUANTITY_USED INTEGER,
     FORECAST_NEXT_7_DAYS FLOAT,
-    STOCK_REMAINING INTEGER
-);
+    STOCK_REMAINING INTEGER,
+    FORECAST_METHOD VARCHAR,
+    REGION VARCHAR,
+    SOURCE_TABLE VARCHAR -- Input table of the run (matches DATA_QUALITY_STATS.TABLE_NAME)
+)
+CLUSTER BY (ITEM_NAME, DATE);
+-- Upgrades from versions that recreated the table on every run
+ALTER TABLE core.FORECAST_RESULTS ADD COLUMN IF NOT EXISTS FORECAST_METHOD VARCHAR;
+ALTER TABLE core.FORECAST_RESULTS ADD COLUMN IF NOT EXISTS REGION VARCHAR;
+ALTER TABLE core.FORECAST_RESULTS ADD COLUMN IF NOT EXISTS SOURCE_TABLE VARCHAR;
+ALTER TABLE core.FORECAST_RESULTS CLUSTER BY (ITEM_NAME, DATE);
 GRANT SELECT ON TABLE core.FORECAST_RESULTS TO APPLICATION ROLE app_public;
 
-GRANT SELECT ON TABLE core.FORECAST_RESULTS TO APPLICATION ROLE app_public;
+-- 4b. Data Quality Stats (one row per profiled table version, appended by data_quality.py)
+-- IF NOT EXISTS keeps the profiling history across upgrades.
+CREATE TABLE IF NOT EXISTS core.DATA_QUALITY_STATS (
+    TABLE_NAME VARCHAR,
+    TABLE_VERSION VARCHAR,
+    HIGH_WATER_DATE DATE,
+    PREFIX_HASH VARCHAR, -- HASH_AGG of the rows up to HIGH_WATER_DATE (edit detection)
+    ROW_COUNT NUMBER,
+    NULL_QUANTITY NUMBER,
+    NULL_STOCK NUMBER,
+    NEGATIVE_STOCK NUMBER,
+    DUPLICATE_KEYS NUMBER,
+    APPROX_DISTINCT_ITEMS NUMBER,
+    DATE_GAPS NUMBER,
+    QUALITY_SCORE FLOAT,
+    REFRESH_MODE VARCHAR,
+    COMPUTED_AT TIMESTAMP_LTZ
+);
+-- Upgrades: rows profiled before the fingerprint existed get a NULL hash, so their next refresh is a full scan
+ALTER TABLE core.DATA_QUALITY_STATS ADD COLUMN IF NOT EXISTS PREFIX_HASH VARCHAR;
+GRANT SELECT ON TABLE core.DATA_QUALITY_STATS TO APPLICATION ROLE app_public;
+
+-- 4c. Inventory Anomalies (rows swapped by forecast_logic.detect_anomalies on each run)
+CREATE TABLE IF NOT EXISTS core.INVENTORY_ANOMALIES (
+    DATE DATE,
+    ITEM_NAME VARCHAR,
+    REGION VARCHAR,
+    ANOMALY_TYPE VARCHAR,
+    OBSERVED FLOAT,
+    EXPECTED FLOAT,
+    SCORE FLOAT,
+    DETAIL VARCHAR
+)
+CLUSTER BY (ITEM_NAME, DATE);
+GRANT SELECT ON TABLE core.INVENTORY_ANOMALIES TO APPLICATION ROLE app_public;
+
+-- 4d. Forecast Accuracy (rows swapped by backtest.py on each backtest run)
+CREATE TABLE IF NOT EXISTS core.FORECAST_ACCURACY (
+    ITEM_NAME VARCHAR,
+    METHOD VARCHAR,
+    HORIZON INTEGER,
+    MAE FLOAT,
+    MAPE FLOAT,
+    BIAS FLOAT,
+    N_ORIGINS INTEGER,
+    IS_BEST BOOLEAN,
+    EVALUATED_AT TIMESTAMP_LTZ
+)
+CLUSTER BY (ITEM_NAME, METHOD);
+GRANT SELECT ON TABLE core.FORECAST_ACCURACY TO APPLICATION ROLE app_public;
+
+-- 4e. Weather-adjusted Forecast Horizon (rows swapped by forecast_logic.weather_adjusted_horizon on each run)
+CREATE TABLE IF NOT EXISTS core.FORECAST_HORIZON (
+    ITEM_NAME VARCHAR,
+    REGION VARCHAR,
+    FORECAST_DATE DATE,
+    HORIZON INTEGER,
+    BASE_FORECAST FLOAT,
+    DEMAND_FACTOR FLOAT,
+    LEAD_TIME_FACTOR FLOAT,
+    ADJUSTED_FORECAST FLOAT,
+    PROJECTED_STOCK FLOAT,
+    EFFECTIVE_LEAD_TIME_DAYS FLOAT,
+    AT_RISK BOOLEAN,
+    WEATHER_EVENTS VARCHAR
+)
+CLUSTER BY (ITEM_NAME, FORECAST_DATE);
+GRANT SELECT ON TABLE core.FORECAST_HORIZON TO APPLICATION ROLE app_public;
+
+-- 4f. Daily Briefings (one row per day, region and program; written by briefings.py)
+-- A re-run replaces only that day's rows; unchanged prompts reuse earlier answers via PROMPT_HASH.
+CREATE TABLE IF NOT EXISTS core.DAILY_BRIEFINGS (
+    BRIEFING_DATE DATE,
+    REGION VARCHAR,
+    SECTOR VARCHAR,
+    MODEL VARCHAR,
+    PROMPT_HASH VARCHAR,
+    BRIEFING VARCHAR,
+    EMAIL_DRAFT VARCHAR,
+    STATUS VARCHAR,
+    SOURCE VARCHAR,
+    GENERATED_AT TIMESTAMP_LTZ
+)
+CLUSTER BY (BRIEFING_DATE, REGION);
+GRANT SELECT ON TABLE core.DAILY_BRIEFINGS TO APPLICATION ROLE app_public;
+
+-- 4g. Read-optimized objects on top of FORECAST_RESULTS
+-- Materialized views are maintained by Snowflake as rows are swapped in; they need Enterprise Edition,
+-- so other editions get plain views under the same names.
+EXECUTE IMMEDIATE $$
+BEGIN
+    -- Last date per item (small, one row per item)
+    CREATE MATERIALIZED VIEW IF NOT EXISTS core.FORECAST_ITEM_LAST_DATE
+        CLUSTER BY (ITEM_NAME)
+        AS SELECT ITEM_NAME, MAX(DATE) AS LAST_DATE, COUNT(*) AS ROW_COUNT
+           FROM core.FORECAST_RESULTS GROUP BY ITEM_NAME;
+    -- Daily roll-up across all items
+    CREATE MATERIALIZED VIEW IF NOT EXISTS core.FORECAST_DAILY_ROLLUP
+        CLUSTER BY (DATE)
+        AS SELECT DATE,
+                  COUNT(*) AS ITEM_ROWS,
+                  SUM(QUANTITY_USED) AS TOTAL_USED,
+                  SUM(FORECAST_NEXT_7_DAYS) AS TOTAL_FORECAST,
+                  SUM(STOCK_REMAINING) AS TOTAL_STOCK,
+                  SUM(IFF(STOCK_REMAINING < 0, 1, 0)) AS NEGATIVE_STOCK_ITEMS
+           FROM core.FORECAST_RESULTS GROUP BY DATE;
+    RETURN 'Materialized';
+EXCEPTION
+    WHEN OTHER THEN
+        CREATE VIEW IF NOT EXISTS core.FORECAST_ITEM_LAST_DATE
+            AS SELECT ITEM_NAME, MAX(DATE) AS LAST_DATE, COUNT(*) AS ROW_COUNT
+               FROM core.FORECAST_RESULTS GROUP BY ITEM_NAME;
+        CREATE VIEW IF NOT EXISTS core.FORECAST_DAILY_ROLLUP
+            AS SELECT DATE,
+                      COUNT(*) AS ITEM_ROWS,
+                      SUM(QUANTITY_USED) AS TOTAL_USED,
+                      SUM(FORECAST_NEXT_7_DAYS) AS TOTAL_FORECAST,
+                      SUM(STOCK_REMAINING) AS TOTAL_STOCK,
+                      SUM(IFF(STOCK_REMAINING < 0, 1, 0)) AS NEGATIVE_STOCK_ITEMS
+               FROM core.FORECAST_RESULTS GROUP BY DATE;
+        RETURN 'Plain views';
+END;
+$$;
+
+-- Latest row per item: the join on (ITEM_NAME, DATE) prunes on the clustering key
+CREATE OR REPLACE VIEW core.FORECAST_LATEST AS
+    SELECT r.*
+    FROM core.FORECAST_RESULTS r
+    JOIN core.FORECAST_ITEM_LAST_DATE l
+      ON r.ITEM_NAME = l.ITEM_NAME AND r.DATE = l.LAST_DATE;
+GRANT SELECT ON VIEW core.FORECAST_LATEST TO APPLICATION ROLE app_public;
+GRANT SELECT ON VIEW core.FORECAST_DAILY_ROLLUP TO APPLICATION ROLE app_public;
 
 -- 5. Register Reference Callback (Required for Manifest)
 CREATE OR REPLACE PROCEDURE core.register_reference(ref_name STRING, operation STRING, ref_or_alias STRING)
@@ -0,0 +1,83 @@
+# 8. The Backtesting Layer (Snowpark Python)
+# Objective: Measure how accurate each forecast method would have been, per item and horizon.
+# Architecture: Rolling-origin evaluation as one set-based query. Every recent row is a forecast origin,
+# LEAD() supplies the actual usage at each horizon, and a small (method x horizon) grid is cross-joined in,
+# so there is no per-item loop and no re-query per origin. Runs unchanged on Snowpark's local testing backend.
+
+import snowflake.snowpark.functions as F
+from snowflake.snowpark.window import Window
+
+import forecast_logic
+
+ACCURACY_TABLE = "FORECAST_ACCURACY"
+
+
+def _pick(key_col, mapping):
+    """CASE key_col WHEN k1 THEN c1 WHEN k2 THEN c2 ... END"""
+    expr = None
+    for key, col in mapping:
+        condition = F.col(key_col) == F.lit(key)
+        expr = F.when(condition, col) if expr is None else expr.when(condition, col)
+    return expr
+
+
+def backtest(session, input_table_name, date_col, item_col, qty_col, horizon=7, n_origins=56, methods=None):
+    """
+    Scores every method in forecast_logic.FORECAST_METHODS over the last `n_origins` origins of each item.
+    Returns one row per (item, method, horizon) with MAE, MAPE (%), BIAS (forecast - actual)
+    and IS_BEST, which marks the method with the lowest mean MAE across horizons for each item.
+    """
+    methods = methods or list(forecast_logic.FORECAST_METHODS)
+
+    # 1. Same cleaning as the forecast itself, so the scores describe what users actually see
+    df = session.table(input_table_name).na.fill({qty_col: 0})
+
+    # 2. One windowed pass: each method's level at the origin, plus the actuals 1..horizon steps ahead
+    ordered = Window.partition_by(item_col).order_by(date_col)
+    latest_first = Window.partition_by(item_col).order_by(F.col(date_col).desc())
+    wide = df.select(
+        F.col(item_col).alias("ITEM_NAME"),
+        F.row_number().over(latest_first).alias("ORIGIN_RANK"),
+        *[forecast_logic.method_level(m, date_col, item_col, qty_col).alias(f"F_{m}") for m in methods],
+        *[F.lead(F.col(qty_col), h).over(ordered).alias(f"A_{h}") for h in range(1, horizon + 1)],
+    )
+    # Keep the n_origins most recent origins that still have a full horizon of actuals
+    wide = wide.filter((F.col("ORIGIN_RANK") > horizon) & (F.col("ORIGIN_RANK") <= horizon + n_origins))
+
+    # 3. Fan out to (method, horizon) pairs with a tiny in-memory grid instead of a loop
+    grid = session.create_dataframe(
+        [[m, h] for m in methods for h in range(1, horizon + 1)], schema=["METHOD", "HORIZON"]
+    )
+    pairs = wide.cross_join(grid).select(
+        "ITEM_NAME", "METHOD", "HORIZON",
+        # Explicit casts: without them Snowpark's local testing backend types the CASE as VARIANT
+        _pick("METHOD", [(m, F.col(f"F_{m}")) for m in methods]).cast("double").alias("FORECAST"),
+        _pick("HORIZON", [(h, F.col(f"A_{h}")) for h in range(1, horizon + 1)]).cast("double").alias("ACTUAL"),
+    ).filter(F.col("ACTUAL").is_not_null())
+
+    # 4. Error metrics per item, method and horizon
+    error = F.col("FORECAST") - F.col("ACTUAL")
+    accuracy = pairs.group_by("ITEM_NAME", "METHOD", "HORIZON").agg(
+        F.avg(F.abs(error)).alias("MAE"),
+        # CASE without ELSE (NULL for zero actuals) and scaled inside the average, so all-zero groups give NULL
+        # on the local testing backend too
+        F.avg(F.when(F.col("ACTUAL") != 0, F.abs(error) * 100 / F.abs(F.col("ACTUAL")))).alias("MAPE"),
+        F.avg(error).alias("BIAS"),
+        F.count(F.col("ACTUAL")).alias("N_ORIGINS"),
+    )
+
+    # 5. Best method per item: lowest MAE averaged over all horizons (ties broken by name)
+    method_mae = F.avg(F.col("MAE")).over(Window.partition_by("ITEM_NAME", "METHOD"))
+    accuracy = accuracy.with_column("METHOD_MAE", method_mae)
+    rank = F.dense_rank().over(Window.partition_by("ITEM_NAME").order_by(F.col("METHOD_MAE"), F.col("METHOD")))
+    return accuracy.with_column("IS_BEST", rank == 1).drop("METHOD_MAE") \
+        .with_column("EVALUATED_AT", F.current_timestamp())
+
+
+# The Stored Procedure Entry Point
+def main(session, input_table_name, date_col, item_col, qty_col, horizon=7, n_origins=56):
+    accuracy_df = backtest(session, input_table_name, date_col, item_col, qty_col, horizon, n_origins)
+    # Swap rows in place so grants and clustering survive (see forecast_logic.replace_table_contents)
+    forecast_logic.replace_table_contents(session, accuracy_df, ACCURACY_TABLE, ["ITEM_NAME", "METHOD"])
+
+    return f"Success: Backtest scored in {ACCURACY_TABLE} ({horizon}-day horizon, {n_origins} origins per item)"
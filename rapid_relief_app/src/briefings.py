@@ -0,0 +1,208 @@
+# 11. The Briefing Layer (Prompt Templates + Daily Batch Job)
+# Objective: One definition of the analyst prompt and restock email, used by the AI Analyst page
+# and by the morning batch that drafts a briefing per region and sector.
+# Architecture: The batch reads one shared snapshot per refresh, skips prompts it has already answered,
+# and sends the rest to Cortex as set-based batches with a bounded number of queries in flight.
+
+import hashlib
+import textwrap
+
+import pandas as pd
+import snowflake.snowpark.functions as F
+from snowflake.snowpark.window import Window
+
+import data_quality
+import forecast_logic
+
+SECTORS = ["Healthcare (Medicines)", "Education (Textbooks/Meals)"]
+BRIEFINGS_TABLE = "DAILY_BRIEFINGS"
+DEFAULT_MODEL = "mistral-large"
+
+
+def sector_profile(sector):
+    """Wording used by prompts and the demo fallback for a sector."""
+    if "Education" in sector:
+        return dict(role="Education Resource Planner", context_str="school supplies (textbooks, meals)",
+                    impact="Student Learning Outcomes", sim_risk_item="Math Textbooks", sim_safe_item="Notebooks")
+    return dict(role="NGO Supply Chain Analyst", context_str="essential medicines",
+                impact="Patient Survival", sim_risk_item="Antibiotics", sim_safe_item="Bandages")
+
+
+def anomaly_context(df_anom, limit=10):
+    """Compact text summary for AI prompts: counts per type plus the most severe rows."""
+    if df_anom.empty:
+        return "No anomalies detected."
+    counts = df_anom['ANOMALY_TYPE'].value_counts()
+    summary = ", ".join(f"{kind}: {n}" for kind, n in counts.items())
+    top = df_anom.sort_values(by='SCORE', ascending=False, na_position='last').head(limit)
+    return f"{summary}\n" + top[['DATE', 'ITEM_NAME', 'ANOMALY_TYPE', 'OBSERVED', 'EXPECTED']].to_string(index=False)
+
+
+# Dedented before the data is filled in: multi-line tables would otherwise stop dedent() from working
+ANALYST_PROMPT = textwrap.dedent("""
+    You are an expert {role}.
+    Analyze the following data table representing inventory for {context_str}:
+
+    {data_context}
+
+    Data anomalies detected in the inventory ledger:
+    {anomaly_str}
+
+    Produce a report in Markdown:
+    1. ** Executive Summary**: Status of {impact}.
+    2. ** 🚨 Critical Risks**: Items running out in < 7 days.
+    3. ** ✅ Safe Items**: Items with good coverage.
+    4. ** ⚠️ Data Issues**: Anomalies that may distort the forecast.
+    5. ** Recommended Actions**: 3 strategic moves.
+
+    Be professional and use emojis.
+    """)
+
+
+def analyst_prompt(sector, data_context, anomaly_str):
+    p = sector_profile(sector)
+    return ANALYST_PROMPT.format(role=p['role'], context_str=p['context_str'], impact=p['impact'],
+                                 data_context=data_context, anomaly_str=anomaly_str)
+
+
+def restock_email(sector, data_context):
+    return f"""
+Subject: Urgent Restock Request - {sector}
+
+Dear Supplier,
+
+Based on current consumption trends and forecasted demand, we require an immediate replenishment of the following critical items:
+
+{data_context}
+
+Please confirm delivery timeline by EOD.
+
+Sincerely,
+AidOps Logistics Team
+"""
+
+
+def _snapshot(session, results_table_name, anomalies_table_name):
+    """Latest row per item-region and the anomaly list, read once for the whole batch."""
+    series = Window.partition_by("ITEM_NAME", "REGION")
+    latest = session.table(results_table_name).with_column(
+        "LAST_DATE", F.max(F.col("DATE")).over(series)
+    ).filter(F.col("DATE") == F.col("LAST_DATE")).select(
+        "ITEM_NAME", F.coalesce(F.col("REGION"), F.lit("ALL")).alias("REGION"), "STOCK_REMAINING", "FORECAST_NEXT_7_DAYS"
+    ).to_pandas()
+    try:
+        anomalies = session.table(anomalies_table_name).to_pandas()
+        anomalies['REGION'] = anomalies['REGION'].fillna("ALL")
+    except Exception:
+        anomalies = pd.DataFrame()
+    return latest, anomalies
+
+
+def _complete_batches(session, prompts, model, max_concurrency, batch_size):
+    """
+    Answers {prompt_hash: prompt} with CORTEX.TRY_COMPLETE. Each batch is one set-based query
+    (the warehouse parallelizes the rows); at most max_concurrency batches run at once.
+    Returns {prompt_hash: response}. A prompt the model rejects gets None without failing its batch;
+    hashes of batches whose whole query failed are missing.
+    """
+    items = list(prompts.items())
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    answers, in_flight = {}, []
+
+    def drain(job):
+        try:
+            for row in job.result():
+                answers[row["PROMPT_HASH"]] = row["RESPONSE"]
+        except Exception:
+            pass # Leave these prompts unanswered; the caller records them as FAILED
+
+    for batch in batches:
+        if len(in_flight) >= max_concurrency:
+            drain(in_flight.pop(0))
+        df = session.create_dataframe([list(pair) for pair in batch], schema=["PROMPT_HASH", "PROMPT"])
+        in_flight.append(df.select(
+            "PROMPT_HASH",
+            # TRY_ variant: a bad or oversized prompt gives NULL for its row instead of failing the batch
+            F.call_function("SNOWFLAKE.CORTEX.TRY_COMPLETE", F.lit(model), F.col("PROMPT")).alias("RESPONSE"),
+        ).collect_nowait())
+    for job in in_flight:
+        drain(job)
+    return answers
+
+
+def generate_daily_briefings(session, sectors=SECTORS, model=DEFAULT_MODEL, max_concurrency=4, batch_size=25,
+                             results_table_name="FORECAST_RESULTS", anomalies_table_name="INVENTORY_ANOMALIES"):
+    """
+    Builds a briefing and a restock email draft for every (region, sector) and returns them as rows.
+    Identical prompts are answered once; prompts already answered by an earlier run (same hash
+    and model in DAILY_BRIEFINGS) are reused without calling Cortex.
+    """
+    # 1. Shared snapshot for every report in this run
+    latest, anomalies = _snapshot(session, results_table_name, anomalies_table_name)
+
+    # 2. Build every report's prompt up front
+    reports = []
+    for region, region_rows in latest.groupby("REGION"):
+        data_context = region_rows[['ITEM_NAME', 'STOCK_REMAINING', 'FORECAST_NEXT_7_DAYS']].to_string(index=False)
+        region_anomalies = anomalies[anomalies['REGION'] == region] if not anomalies.empty else anomalies
+        anomaly_str = anomaly_context(region_anomalies)
+        for sector in sectors:
+            prompt = analyst_prompt(sector, data_context, anomaly_str)
+            reports.append(dict(
+                REGION=region, SECTOR=sector, MODEL=model, PROMPT=prompt,
+                PROMPT_HASH=hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest(),
+                EMAIL_DRAFT=restock_email(sector, data_context),
+            ))
+
+    # 3. Prompt cache: in-run duplicates collapse in the dict, earlier answers come from the table
+    pending = {r["PROMPT_HASH"]: r["PROMPT"] for r in reports}
+    cached = {}
+    if pending and data_quality.table_exists(session, BRIEFINGS_TABLE):
+        rows = session.table(BRIEFINGS_TABLE).filter(
+            (F.col("STATUS") == F.lit("OK")) & F.col("PROMPT_HASH").isin(list(pending))
+        ).select("PROMPT_HASH", "BRIEFING").distinct().collect()
+        cached = {row["PROMPT_HASH"]: row["BRIEFING"] for row in rows}
+    to_ask = {h: p for h, p in pending.items() if h not in cached}
+
+    # 4. Fan out the rest with bounded concurrency
+    answers = dict(cached)
+    answers.update(_complete_batches(session, to_ask, model, max_concurrency, batch_size))
+
+    for r in reports:
+        r["BRIEFING"] = answers.get(r["PROMPT_HASH"])
+        r["STATUS"] = "OK" if r["BRIEFING"] is not None else "FAILED"
+        r["SOURCE"] = "CACHE" if r["PROMPT_HASH"] in cached else "CORTEX"
+        del r["PROMPT"]
+    return reports
+
+
+# The Stored Procedure Entry Point
+def main(session, model=DEFAULT_MODEL, max_concurrency=4):
+    reports = generate_daily_briefings(session, model=model, max_concurrency=max_concurrency)
+    if not reports:
+        return "No forecast data: run the forecast first."
+
+    columns = ["REGION", "SECTOR", "MODEL", "PROMPT_HASH", "BRIEFING", "EMAIL_DRAFT", "STATUS", "SOURCE"]
+    df = session.create_dataframe([[r[c] for c in columns] for r in reports], schema=columns).select(
+        F.current_date().alias("BRIEFING_DATE"), *columns, F.current_timestamp().alias("GENERATED_AT")
+    )
+
+    # Re-running on the same day replaces that day's briefings; earlier days stay as history
+    if data_quality.table_exists(session, BRIEFINGS_TABLE):
+        # Staged before BEGIN: creating the temp table is DDL, which would commit the transaction early
+        staged = df.cache_result()
+        columns = ", ".join(staged.columns)
+        session.sql("BEGIN").collect()
+        try:
+            session.sql(f"DELETE FROM {BRIEFINGS_TABLE} WHERE BRIEFING_DATE = CURRENT_DATE()").collect()
+            session.sql(f"INSERT INTO {BRIEFINGS_TABLE} ({columns}) SELECT {columns} FROM {staged.table_name}").collect()
+            session.sql("COMMIT").collect()
+        except Exception:
+            session.sql("ROLLBACK").collect() # Keep the day's previous briefings
+            raise
+    else:
+        forecast_logic.replace_table_contents(session, df, BRIEFINGS_TABLE, ["BRIEFING_DATE", "REGION"])
+
+    failed = sum(1 for r in reports if r["STATUS"] != "OK")
+    cached = sum(1 for r in reports if r["SOURCE"] == "CACHE")
+    return f"Success: {len(reports)} briefings in {BRIEFINGS_TABLE} ({cached} from cache, {failed} failed)"
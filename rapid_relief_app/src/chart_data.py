@@ -0,0 +1,185 @@
+# 7. The Chart Data Service (Snowpark + Plotly)
+# Objective: Keep forecast charts fast on multi-year daily histories.
+# Architecture: Min/max bucketing runs in the warehouse, LTTB trims the result to the pixel width,
+# and finished figures are cached per (items, range, table version) so reruns skip both steps.
+
+from collections import OrderedDict
+import threading
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+import snowflake.snowpark.functions as F
+from snowflake.snowpark.window import Window
+
+DEFAULT_WIDTH_PX = 1200 # Roughly the plot area of a wide-layout Streamlit chart
+WEBGL_THRESHOLD = 1000 # Points per figure above which Scattergl replaces SVG Scatter
+CACHE_SIZE = 64
+
+# Default look of the Dashboard's "Forecast Trends" chart
+FORECAST_SERIES = OrderedDict([
+    ("QUANTITY_USED", {"name": "Actual", "line": dict(color="gray")}),
+    ("FORECAST_NEXT_7_DAYS", {"name": "Forecast", "line": dict(color="#2E86C1", width=3, dash="dot")}),
+])
+
+_figure_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Keeps the first and last point and, per bucket, the point that forms the largest
+    triangle with its neighbours, so peaks and troughs survive. Returns selected indices.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    y = np.where(np.isnan(y), 0.0, y)
+
+    selected = np.empty(n_out, dtype="int64")
+    selected[0] = 0
+    selected[-1] = n - 1
+    edges = np.linspace(1, n - 1, n_out - 1).astype("int64")
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        # Average of the next bucket acts as the third vertex
+        nxt_start = edges[i + 1]
+        nxt_end = max(edges[i + 2] if i + 2 < len(edges) else n, nxt_start + 1)
+        avg_x = x[nxt_start:nxt_end].mean()
+        avg_y = y[nxt_start:nxt_end].mean()
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def fetch_bucketed(session, table_name, items, value_cols, start=None, end=None, n_buckets=DEFAULT_WIDTH_PX,
+                   date_col="DATE", item_col="ITEM_NAME", split_col=None):
+    """
+    Min/max bucketing in the warehouse: each series is cut into n_buckets equal date ranges
+    and only the minimum and maximum point of every bucket is returned.
+    Result is long format: item, [split], SERIES, DATE, VALUE.
+    """
+    df = session.table(table_name).filter(F.col(item_col).isin(list(items)))
+    if start is not None:
+        df = df.filter(F.col(date_col) >= F.lit(start))
+    if end is not None:
+        df = df.filter(F.col(date_col) <= F.lit(end))
+
+    keys = [item_col] + ([split_col] if split_col else [])
+    series = Window.partition_by(*keys)
+    first_day = F.min(F.col(date_col)).over(series)
+    span = F.datediff("day", first_day, F.max(F.col(date_col)).over(series)) + 1
+    bucketed = df.with_column(
+        "BUCKET", F.floor(F.datediff("day", first_day, F.col(date_col)) * F.lit(n_buckets) / span)
+    )
+
+    aggs = []
+    for v in value_cols:
+        aggs += [
+            F.call_function("MIN_BY", F.col(date_col), F.col(v)).alias(f"{v}__MIN_X"),
+            F.min(F.col(v)).alias(f"{v}__MIN_Y"),
+            F.call_function("MAX_BY", F.col(date_col), F.col(v)).alias(f"{v}__MAX_X"),
+            F.max(F.col(v)).alias(f"{v}__MAX_Y"),
+        ]
+    buckets = bucketed.group_by(*keys, "BUCKET").agg(*aggs).to_pandas()
+
+    # Unpivot (min, max) pairs into plain points; identical points collapse when a bucket holds one row
+    frames = []
+    for v in value_cols:
+        for edge in ("MIN", "MAX"):
+            part = buckets[keys].copy()
+            part["SERIES"] = v
+            part[date_col] = buckets[f"{v}__{edge}_X"]
+            part["VALUE"] = buckets[f"{v}__{edge}_Y"]
+            frames.append(part)
+    if not frames:
+        return pd.DataFrame(columns=keys + ["SERIES", date_col, "VALUE"])
+    points = pd.concat(frames, ignore_index=True).dropna(subset=[date_col])
+    points[date_col] = pd.to_datetime(points[date_col])
+    return points.drop_duplicates().sort_values(keys + ["SERIES", date_col]).reset_index(drop=True)
+
+
+def downsample(points, keys, n_out, date_col="DATE"):
+    """Applies LTTB to every (keys, SERIES) group of a long-format points frame."""
+    parts = []
+    for _, group in points.groupby(keys + ["SERIES"], sort=False):
+        x = group[date_col].values.astype("datetime64[ns]").astype("int64")
+        parts.append(group.iloc[lttb(x, group["VALUE"].values, n_out)])
+    return pd.concat(parts, ignore_index=True) if parts else points
+
+
+def build_figure(points, styles=FORECAST_SERIES, split_col=None, date_col="DATE", item_col="ITEM_NAME",
+                 webgl_threshold=WEBGL_THRESHOLD, height=350):
+    """
+    Builds the Plotly figure: one trace per (item, series), optionally one row per split value
+    (region small multiples). Switches to WebGL traces for large point counts.
+    """
+    trace_cls = go.Scattergl if len(points) > webgl_threshold else go.Scatter
+    panels = sorted(points[split_col].dropna().unique()) if split_col else [None]
+    items = list(pd.unique(points[item_col]))
+    overlay = len(items) > 1
+
+    if split_col:
+        fig = make_subplots(rows=len(panels), cols=1, shared_xaxes=True, subplot_titles=[str(p) for p in panels],
+                            vertical_spacing=min(0.08, 0.3 / max(len(panels), 1)))
+        height = max(height, 220 * len(panels))
+    else:
+        fig = go.Figure()
+
+    for row, panel in enumerate(panels, start=1):
+        panel_points = points if panel is None else points[points[split_col] == panel]
+        for item in items:
+            for series, style in styles.items():
+                trace = panel_points[(panel_points[item_col] == item) & (panel_points["SERIES"] == series)]
+                if trace.empty:
+                    continue
+                line = dict(style["line"])
+                if overlay:
+                    line.pop("color", None) # Let Plotly colour each item
+                name = f"{item} · {style['name']}" if overlay else style["name"]
+                kwargs = dict(row=row, col=1) if split_col else {}
+                fig.add_trace(trace_cls(x=trace[date_col], y=trace["VALUE"], mode="lines", name=name, line=line,
+                                        legendgroup=name, showlegend=(row == 1)), **kwargs)
+
+    fig.update_layout(height=height, margin=dict(l=20, r=20, t=30, b=20), template="plotly_white")
+    return fig
+
+
+def forecast_chart(session, table_name, items, start=None, end=None, width_px=DEFAULT_WIDTH_PX,
+                   split_col=None, version=None, styles=FORECAST_SERIES, date_col="DATE", item_col="ITEM_NAME"):
+    """
+    Returns a downsampled forecast figure for one or more items.
+    Figures are cached per (table, items, range, width, split, version); pass the table
+    version (see data_quality.table_version) so a refresh invalidates them. Without a
+    version nothing is cached.
+    """
+    key = (table_name, tuple(sorted(items)), start, end, width_px, split_col, version, tuple(styles))
+    if version is not None:
+        with _cache_lock:
+            if key in _figure_cache:
+                _figure_cache.move_to_end(key)
+                return go.Figure(_figure_cache[key]) # Copy, callers add annotations
+
+    keys = [item_col] + ([split_col] if split_col else [])
+    points = fetch_bucketed(session, table_name, items, list(styles), start, end, width_px,
+                            date_col=date_col, item_col=item_col, split_col=split_col)
+    points = downsample(points, keys, width_px, date_col=date_col)
+    fig = build_figure(points, styles, split_col=split_col, date_col=date_col, item_col=item_col)
+
+    if version is not None:
+        with _cache_lock:
+            _figure_cache[key] = fig
+            while len(_figure_cache) > CACHE_SIZE:
+                _figure_cache.popitem(last=False)
+    return go.Figure(fig)
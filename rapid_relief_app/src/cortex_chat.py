@@ -0,0 +1,195 @@
+# 10. The Chat Layer (Cortex Streaming + Bounded Memory)
+# Objective: Show Commander Chat answers token by token and keep long sessions cheap.
+# Architecture: Pluggable backends (Cortex, or an offline stub for local runs and tests) expose stream(prompt).
+# ChatMemory keeps a fixed number of recent messages and folds older ones into a short rolling summary,
+# so both the rendered history and the prompt stay the same size however long the session runs.
+
+import collections
+import queue
+import re
+import threading
+import time
+
+try:
+    # snowflake-ml-python: the only Cortex entry point that streams tokens
+    from snowflake.cortex import Complete as _cortex_complete
+except ImportError:
+    _cortex_complete = None
+
+DEFAULT_MODELS = ("mistral-large", "llama3-8b", "gemma-7b")
+_DONE = object() # End-of-stream marker on the reader queue
+
+
+class CortexBackend:
+    """Streams from the first model in `models` that answers (same cascade as before, minus the wait)."""
+
+    def __init__(self, session, models=DEFAULT_MODELS, timeout_s=None):
+        self.session = session
+        self.models = models
+        # Streamed answers come over REST, where STATEMENT_TIMEOUT_IN_SECONDS does not apply,
+        # so the limit is enforced here on every read, including the wait for the first token
+        self.timeout_s = timeout_s
+        self.model = None # Model that produced the last answer
+
+    def _stream_model(self, model, prompt):
+        if _cortex_complete is not None:
+            return iter(_cortex_complete(model, prompt, session=self.session, stream=True))
+        # SQL fallback cannot stream: the whole answer arrives as a single chunk
+        safe_prompt = prompt.replace("'", "''")
+        q = f"SELECT SNOWFLAKE.CORTEX.COMPLETE('{model}', '{safe_prompt}') as response"
+        return iter([self.session.sql(q).collect()[0]['RESPONSE']])
+
+    def _read(self, model, prompt, chunks, stop):
+        # Reader thread: a blocked network read cannot be interrupted, so it happens here and
+        # stream() waits on the queue with a timeout instead
+        try:
+            for chunk in self._stream_model(model, prompt):
+                if stop.is_set():
+                    return # Caller gave up; drop the rest of the answer
+                chunks.put(chunk)
+            chunks.put(_DONE)
+        except Exception as e:
+            chunks.put(e)
+
+    def stream(self, prompt):
+        """
+        Yields the answer chunk by chunk. With `timeout_s`, raises TimeoutError once the whole answer
+        (first token included) takes longer; the abandoned reader thread exits after its next chunk.
+        """
+        last_error = None
+        deadline = time.monotonic() + self.timeout_s if self.timeout_s else None
+
+        def next_chunk(chunks):
+            try:
+                return chunks.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise TimeoutError(f"Answer cut off after {self.timeout_s}s") from None
+
+        for model in self.models:
+            chunks, stop = queue.Queue(), threading.Event()
+            threading.Thread(target=self._read, args=(model, prompt, chunks, stop), daemon=True).start()
+            try:
+                # Fail over only while nothing has been shown yet; after the first token we are committed
+                first = next_chunk(chunks)
+                if isinstance(first, Exception):
+                    last_error = first
+                    continue
+                self.model = model
+                if first is _DONE:
+                    return
+                yield first
+                while True:
+                    chunk = next_chunk(chunks)
+                    if chunk is _DONE:
+                        return
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    yield chunk
+            finally:
+                stop.set()
+        raise RuntimeError(f"No Cortex model available: {last_error}")
+
+
+class StubBackend:
+    """Offline backend for Local Mode and tests: streams a canned reply word by word, no warehouse needed."""
+
+    def __init__(self, reply="COPY. Stub link active, no model consulted. Check the Dashboard for live status.", delay_s=0.02):
+        self.reply = reply
+        self.delay_s = delay_s
+        self.model = "stub"
+        self.prompts = [] # Every prompt received, for assertions
+
+    def stream(self, prompt):
+        self.prompts.append(prompt)
+        reply = self.reply(prompt) if callable(self.reply) else self.reply
+        for word in reply.split(" "):
+            if self.delay_s:
+                time.sleep(self.delay_s)
+            yield word + " "
+
+
+def extractive_summary(text, max_chars):
+    """Local summarizer: first sentence of every line, keeping the most recent lines that fit."""
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line:
+            first = re.split(r"(?<=[.!?])\s", line, maxsplit=1)[0]
+            lines.append(first[:160])
+    kept, size = [], 0
+    for line in reversed(lines):
+        if size + len(line) + 1 > max_chars:
+            break
+        kept.append(line)
+        size += len(line) + 1
+    return "\n".join(reversed(kept))
+
+
+def cortex_summarizer(session, run_sql=None):
+    """
+    Summarizer backed by SNOWFLAKE.CORTEX.SUMMARIZE (one call per fold), trimmed to the size budget.
+    `run_sql(query)` returns the result rows; pass one that applies admission and timeouts
+    (e.g. Governor.sql). Defaults to a plain session.sql(...).collect().
+    """
+    run_sql = run_sql or (lambda query: session.sql(query).collect())
+
+    def summarize(text, max_chars):
+        safe_text = text.replace("'", "''")
+        summary = run_sql(f"SELECT SNOWFLAKE.CORTEX.SUMMARIZE('{safe_text}') as summary")[0]['SUMMARY']
+        return summary[:max_chars]
+    return summarize
+
+
+class ChatMemory:
+    """
+    Bounded conversation memory: the last `max_messages` messages verbatim, everything older
+    folded into `summary` (at most `max_summary_chars`). append() never calls the summarizer;
+    compact() folds the oldest `fold_batch` messages in one call once the ring is over
+    `max_messages`, so it is meant to run after an answer has streamed. If the summarizer
+    fails, the local extractive summary is used instead.
+    """
+
+    def __init__(self, max_messages=12, max_summary_chars=1200, max_prompt_chars_per_message=500, summarizer=None,
+                 fold_batch=None):
+        self.max_messages = max_messages
+        self.max_summary_chars = max_summary_chars
+        self.max_prompt_chars_per_message = max_prompt_chars_per_message
+        self.summarizer = summarizer or extractive_summary
+        self.fold_batch = fold_batch or max(1, max_messages // 2) # Half the ring per summarizer call
+        self.recent = collections.deque()
+        self.summary = ""
+        self.folded = 0 # Messages folded into the summary so far
+
+    def append(self, role, content):
+        self.recent.append({"role": role, "content": content})
+        # Safety net for callers that never compact(); normal turns leave folding to compact()
+        if len(self.recent) > 2 * self.max_messages:
+            self.compact()
+
+    def compact(self):
+        """Folds a batch of the oldest messages if the ring is over max_messages. Returns how many were folded."""
+        if len(self.recent) <= self.max_messages:
+            return 0
+        count = max(self.fold_batch, len(self.recent) - self.max_messages)
+        evicted = [self.recent.popleft() for _ in range(min(count, len(self.recent)))]
+        self._fold(evicted)
+        return len(evicted)
+
+    def _fold(self, evicted):
+        text = "\n".join(f"{m['role']}: {m['content']}" for m in evicted)
+        merged = f"{self.summary}\n{text}".strip()
+        try:
+            summary = self.summarizer(merged, self.max_summary_chars)
+        except Exception:
+            summary = extractive_summary(merged, self.max_summary_chars)
+        self.summary = summary[-self.max_summary_chars:]
+        self.folded += len(evicted)
+
+    def prompt_memory(self):
+        """Conversation memory for the prompt: rolling summary plus the (truncated) recent turns."""
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of earlier conversation: {self.summary}")
+        for m in self.recent:
+            parts.append(f"{m['role']}: {m['content'][:self.max_prompt_chars_per_message]}")
+        return "\n".join(parts) if parts else "None"
@@ -0,0 +1,210 @@
+# 6. The Data Quality Layer (Snowpark Python)
+# Objective: Profile the whole inventory table inside the warehouse instead of sampling rows into pandas.
+# Architecture: One set-based scan per refresh; results are stored per table version in core.DATA_QUALITY_STATS
+# so the Dashboard and Connect Data pages only read a precomputed row.
+
+import snowflake.snowpark.functions as F
+from snowflake.snowpark.types import (
+    DateType, DoubleType, LongType, StringType, StructField, StructType
+)
+from snowflake.snowpark.window import Window
+
+STATS_TABLE = "core.DATA_QUALITY_STATS"
+# Last seen DATE per item, used to count date gaps across incremental refreshes.
+ITEM_STATE_TABLE = "core.DATA_QUALITY_ITEM_STATE"
+
+STATS_SCHEMA = StructType([
+    StructField("TABLE_NAME", StringType()),
+    StructField("TABLE_VERSION", StringType()),
+    StructField("HIGH_WATER_DATE", DateType()),
+    StructField("PREFIX_HASH", StringType()),
+    StructField("ROW_COUNT", LongType()),
+    StructField("NULL_QUANTITY", LongType()),
+    StructField("NULL_STOCK", LongType()),
+    StructField("NEGATIVE_STOCK", LongType()),
+    StructField("DUPLICATE_KEYS", LongType()),
+    StructField("APPROX_DISTINCT_ITEMS", LongType()),
+    StructField("DATE_GAPS", LongType()),
+    StructField("QUALITY_SCORE", DoubleType()),
+    StructField("REFRESH_MODE", StringType()),
+])
+
+
+def table_version(session, table_name):
+    """
+    Returns a token that changes whenever the table is modified, or None if the
+    warehouse cannot tell us (e.g. the name is an unresolved reference).
+    """
+    try:
+        safe_name = table_name.replace("'", "''")
+        row = session.sql(f"SELECT SYSTEM$LAST_CHANGE_COMMIT_TIME('{safe_name}') AS VERSION").collect()[0]
+        return str(row["VERSION"])
+    except Exception:
+        return None
+
+
+def latest_quality_stats(session, table_name=None):
+    """
+    Reads the most recent stats row (for one table, or for any table if None).
+    Returns a dict, or None if the table has never been profiled.
+    """
+    try:
+        stats = session.table(STATS_TABLE)
+        if table_name is not None:
+            stats = stats.filter(F.col("TABLE_NAME") == F.lit(table_name))
+        rows = stats.sort(F.col("COMPUTED_AT").desc()).limit(1).collect()
+    except Exception:
+        return None
+    return rows[0].as_dict() if rows else None
+
+
+def prefix_fingerprint(session, table_name, date_col, hwm):
+    """Row count and HASH_AGG of the rows at or before the high-water mark, computed in the warehouse."""
+    df = session.table(table_name).filter(F.col(date_col) <= F.lit(hwm))
+    digest = F.call_function("HASH_AGG", *[F.col(c) for c in df.columns])
+    row = df.agg(F.count(F.lit(1)).alias("N"), digest.alias("H")).collect()[0]
+    return int(row["N"]), str(row["H"])
+
+
+def table_exists(session, table_name):
+    try:
+        session.table(table_name).limit(0).collect()
+        return True
+    except Exception:
+        return False
+
+
+def _profile(session, source, table_name, date_col, item_col, qty_col, stock_col, anchors=None):
+    """
+    Computes all counters for `source` in one pass.
+    `anchors` holds the last known DATE per item from earlier refreshes; those rows only
+    feed the LAG() window so gaps spanning the refresh boundary are still counted.
+    """
+    scanned = source.select(
+        F.col(date_col).alias("D"),
+        F.col(item_col).alias("ITEM"),
+        F.col(qty_col).cast(DoubleType()).alias("QTY"),
+        F.col(stock_col).cast(DoubleType()).alias("STOCK"),
+        F.lit(False).alias("IS_ANCHOR"),
+    )
+    if anchors is not None:
+        scanned = scanned.union_all_by_name(anchors)
+
+    # Days skipped since the previous row of the same item (0 for consecutive or duplicate days)
+    by_item = Window.partition_by("ITEM").order_by("D")
+    windowed = scanned.with_column(
+        "GAP_DAYS",
+        F.greatest(F.datediff("day", F.lag("D").over(by_item), F.col("D")) - 1, F.lit(0)),
+    ).with_column(
+        "IS_LAST", F.lead("D").over(by_item).is_null()
+    ).cache_result()
+
+    is_row = ~F.col("IS_ANCHOR")
+    totals = windowed.agg(
+        F.sum(F.iff(is_row, 1, 0)).alias("ROW_COUNT"),
+        F.sum(F.iff(is_row & F.col("QTY").is_null(), 1, 0)).alias("NULL_QUANTITY"),
+        F.sum(F.iff(is_row & F.col("STOCK").is_null(), 1, 0)).alias("NULL_STOCK"),
+        F.sum(F.iff(is_row & (F.col("STOCK") < 0), 1, 0)).alias("NEGATIVE_STOCK"),
+        # COUNT(DISTINCT a, b) skips rows where any argument is NULL, which drops the anchors
+        F.count_distinct(F.iff(is_row, F.col("D"), F.lit(None)), F.col("ITEM")).alias("DISTINCT_KEYS"),
+        # Anchors carry every previously seen item, so this estimate covers the whole table
+        F.approx_count_distinct(F.col("ITEM")).alias("APPROX_DISTINCT_ITEMS"),
+        F.sum(F.coalesce(F.col("GAP_DAYS"), F.lit(0))).alias("DATE_GAPS"),
+        F.max(F.iff(is_row, F.col("D"), F.lit(None))).alias("HIGH_WATER_DATE"),
+    ).collect()[0].as_dict()
+
+    # Anchors without newer rows are still the last row of their item, so this covers every item seen so far
+    last_dates = windowed.filter(F.col("IS_LAST")).select(
+        F.lit(table_name).alias("TABLE_NAME"),
+        F.col("ITEM").alias("ITEM_NAME"),
+        F.col("D").alias("LAST_DATE"),
+    )
+    return totals, last_dates
+
+
+def refresh_quality_stats(session, table_name, date_col="DATE", item_col="ITEM_NAME",
+                          qty_col="QUANTITY_USED", stock_col="STOCK_REMAINING", full_refresh=False):
+    """
+    Profiles `table_name` and appends a row to core.DATA_QUALITY_STATS.
+    If the table version has not changed, the stored row is returned as-is.
+    Otherwise only rows dated after the stored high-water mark are scanned and folded
+    into the previous counters. Edits, deletes or inserts at or before the mark change the stored
+    prefix fingerprint (row count + HASH_AGG) and trigger a full scan instead.
+    """
+    # 1. Skip the scan entirely if nothing changed since the last profile
+    version = table_version(session, table_name)
+    previous = latest_quality_stats(session, table_name)
+    if previous and not full_refresh and version is not None and previous["TABLE_VERSION"] == version:
+        return previous
+
+    source = session.table(table_name)
+    total_rows = source.count() # Answered from table metadata, no scan
+
+    # 2. Incremental pass: new rows only, anchored on each item's last known date
+    stats = None
+    if previous and not full_refresh and previous["HIGH_WATER_DATE"] is not None and previous.get("PREFIX_HASH"):
+        anchors = session.table(ITEM_STATE_TABLE).filter(F.col("TABLE_NAME") == F.lit(table_name)).select(
+            F.col("LAST_DATE").alias("D"),
+            F.col("ITEM_NAME").alias("ITEM"),
+            F.lit(None).cast(DoubleType()).alias("QTY"),
+            F.lit(None).cast(DoubleType()).alias("STOCK"),
+            F.lit(True).alias("IS_ANCHOR"),
+        )
+        delta = source.filter(F.col(date_col) > F.lit(previous["HIGH_WATER_DATE"]))
+        totals, last_dates = _profile(session, delta, table_name, date_col, item_col, qty_col, stock_col, anchors)
+
+        # Append-only check: the profiled rows must be byte-for-byte unchanged, not just equally many
+        _, prefix_hash = prefix_fingerprint(session, table_name, date_col, previous["HIGH_WATER_DATE"])
+        if prefix_hash == previous["PREFIX_HASH"] and previous["ROW_COUNT"] + (totals["ROW_COUNT"] or 0) == total_rows:
+            stats = {
+                "ROW_COUNT": total_rows,
+                "NULL_QUANTITY": previous["NULL_QUANTITY"] + (totals["NULL_QUANTITY"] or 0),
+                "NULL_STOCK": previous["NULL_STOCK"] + (totals["NULL_STOCK"] or 0),
+                "NEGATIVE_STOCK": previous["NEGATIVE_STOCK"] + (totals["NEGATIVE_STOCK"] or 0),
+                # New rows are strictly later than the high-water mark, so they cannot collide with old keys
+                "DUPLICATE_KEYS": previous["DUPLICATE_KEYS"] + (totals["ROW_COUNT"] or 0) - (totals["DISTINCT_KEYS"] or 0),
+                "APPROX_DISTINCT_ITEMS": totals["APPROX_DISTINCT_ITEMS"] or 0,
+                "DATE_GAPS": previous["DATE_GAPS"] + (totals["DATE_GAPS"] or 0),
+                "HIGH_WATER_DATE": totals["HIGH_WATER_DATE"] or previous["HIGH_WATER_DATE"],
+                "REFRESH_MODE": "INCREMENTAL",
+            }
+
+    # 3. Full pass: first profile, forced refresh, or rewritten history
+    if stats is None:
+        totals, last_dates = _profile(session, source, table_name, date_col, item_col, qty_col, stock_col)
+        stats = {
+            "ROW_COUNT": totals["ROW_COUNT"] or 0,
+            "NULL_QUANTITY": totals["NULL_QUANTITY"] or 0,
+            "NULL_STOCK": totals["NULL_STOCK"] or 0,
+            "NEGATIVE_STOCK": totals["NEGATIVE_STOCK"] or 0,
+            "DUPLICATE_KEYS": (totals["ROW_COUNT"] or 0) - (totals["DISTINCT_KEYS"] or 0),
+            "APPROX_DISTINCT_ITEMS": totals["APPROX_DISTINCT_ITEMS"] or 0,
+            "DATE_GAPS": totals["DATE_GAPS"] or 0,
+            "HIGH_WATER_DATE": totals["HIGH_WATER_DATE"],
+            "REFRESH_MODE": "FULL",
+        }
+
+    # 4. Score = share of expected (item, day) slots that are present and clean
+    issues = stats["NULL_QUANTITY"] + stats["NEGATIVE_STOCK"] + stats["DUPLICATE_KEYS"] + stats["DATE_GAPS"]
+    expected = stats["ROW_COUNT"] + stats["DATE_GAPS"]
+    stats["QUALITY_SCORE"] = round(100.0 * max(0.0, 1.0 - issues / expected), 1) if expected else 100.0
+    stats["TABLE_NAME"] = table_name
+    stats["TABLE_VERSION"] = version or ""
+    # Fingerprint of everything profiled so far, checked by the next incremental refresh
+    stats["PREFIX_HASH"] = prefix_fingerprint(session, table_name, date_col, stats["HIGH_WATER_DATE"])[1] \
+        if stats["HIGH_WATER_DATE"] is not None else None
+
+    # 5. Persist the per-item anchors and the new stats row
+    # The anchor table is internal to the app, so overwriting it does not lose any consumer grant.
+    other_tables = session.table(ITEM_STATE_TABLE).filter(F.col("TABLE_NAME") != F.lit(table_name)) \
+        if table_exists(session, ITEM_STATE_TABLE) else None
+    state = last_dates if other_tables is None else other_tables.union_all(last_dates)
+    state.cache_result().write.mode("overwrite").save_as_table(ITEM_STATE_TABLE)
+
+    row_df = session.create_dataframe([[stats[f.name] for f in STATS_SCHEMA.fields]], schema=STATS_SCHEMA) \
+        .with_column("COMPUTED_AT", F.current_timestamp())
+    # By name: upgraded tables get PREFIX_HASH appended after COMPUTED_AT
+    row_df.write.mode("append").save_as_table(STATS_TABLE, column_order="name")
+
+    return stats
+
@@ -6,10 +6,31 @@
 import snowflake.snowpark.functions as F
 from snowflake.snowpark.window import Window
 
-def calculate_forecast(session, input_table_name, date_col, item_col, qty_col):
+import data_quality
+
+# Forecast methods: name -> number of trailing days averaged (NAIVE repeats the last day).
+# Every method is a flat daily level, so backtest.py can score them all in the same pass.
+FORECAST_METHODS = {
+    "NAIVE": 1,
+    "MA3": 3,
+    "MA7": 7,
+    "MA14": 14,
+    "MA28": 28,
+}
+DEFAULT_METHOD = "MA7"
+
+def method_level(method, date_col, item_col, qty_col):
+    """Window expression for the daily forecast level of `method` at each row."""
+    window = FORECAST_METHODS[method]
+    window_spec = Window.partition_by(item_col).order_by(date_col).rows_between(-(window - 1), 0)
+    return F.avg(F.col(qty_col)).over(window_spec)
+
+def calculate_forecast(session, input_table_name, date_col, item_col, qty_col, method=DEFAULT_METHOD):
     """
     Reads data from the input table, fills nulls in quantity with 0,
     and calculates a 7-day moving average to forecast the next 7 days.
+    With method="AUTO", each item uses the method marked IS_BEST by the last backtest
+    (falling back to the 7-day average for items that were never backtested).
     """
     # 1. Read the input table (Dynamic reference provided by the app)
     df = session.table(input_table_name)
@@ -17,33 +38,295 @@ def calculate_forecast(session, input_table_name, date_col, item_col, qty_col):
     # 2. Data Cleaning: Fill NULL quantity with 0 (assuming null means no usage)
     df_clean = df.na.fill({qty_col: 0})
 
-    # 3. Forecast Logic: 7-Day Moving Average
+    # 3. Forecast Logic: 7-Day Moving Average by default (see FORECAST_METHODS)
     # We partition by Item to forecast per item history.
-    # Rows between 6 preceding and current row covers 7 days.
-    window_spec = Window.partition_by(item_col).order_by(date_col).rows_between(-6, 0)
-    
-    df_forecast = df_clean.with_column(
-        "FORECAST_NEXT_7_DAYS", 
-        F.avg(F.col(qty_col)).over(window_spec)
-    )
+    # For MA7, rows between 6 preceding and current row covers 7 days.
+    if method != "AUTO":
+        df_forecast = df_clean.with_column(
+            "FORECAST_NEXT_7_DAYS", 
+            method_level(method, date_col, item_col, qty_col)
+        ).with_column("FORECAST_METHOD", F.lit(method))
+    else:
+        # Per-item choice: compute every candidate level, then pick the winner with one CASE
+        best = session.table("FORECAST_ACCURACY").filter(F.col("IS_BEST")).select(
+            F.col("ITEM_NAME").alias("BEST_ITEM"), F.col("METHOD").alias("FORECAST_METHOD")
+        ).distinct()
+        df_joined = df_clean.join(best, df_clean[item_col] == best["BEST_ITEM"], "left").drop("BEST_ITEM")
+        df_joined = df_joined.with_column("FORECAST_METHOD", F.coalesce(F.col("FORECAST_METHOD"), F.lit(DEFAULT_METHOD)))
+
+        level = None
+        for name in FORECAST_METHODS:
+            condition = F.col("FORECAST_METHOD") == F.lit(name)
+            expr = method_level(name, date_col, item_col, qty_col)
+            level = F.when(condition, expr) if level is None else level.when(condition, expr)
+        df_forecast = df_joined.with_column("FORECAST_NEXT_7_DAYS", level)
 
     # 4. Return the result
     # In a real app, we might write this to a result table. 
     # Here, we return the dataframe for the Stored Proc to handle (e.g., return query ID or data).
     return df_forecast
 
+def detect_anomalies(session, input_table_name, date_col, item_col, qty_col, stock_col="STOCK_REMAINING",
+                     region_col="REGION", tolerance_units=1, tolerance_pct=0.02, z_threshold=3.0,
+                     spike_window=28, stale_days=7):
+    """
+    Flags inventory anomalies in a single windowed pass over the input table:
+    - LEDGER_MISMATCH: previous stock - used != stock (beyond tolerance)
+    - MISSING_USAGE: QUANTITY_USED is NULL, so the stock movement cannot be explained
+    - NEGATIVE_STOCK: physically impossible stock level
+    - USAGE_SPIKE: usage more than z_threshold rolling std-devs away from the trailing mean
+    - STALE_SERIES: the item stopped reporting stale_days before the latest date in the table
+    Returns a long-format dataframe (one row per anomaly) for core.INVENTORY_ANOMALIES.
+    """
+    df = session.table(input_table_name)
+
+    # 1. Series key: per item-region when the table has a region, otherwise per item
+    has_region = region_col.upper() in [c.strip('"').upper() for c in df.columns]
+    region = F.col(region_col) if has_region else F.lit(None).cast("string")
+    series = [item_col, region_col] if has_region else [item_col]
+
+    ordered = Window.partition_by(*series).order_by(date_col)
+    # Trailing window that excludes the current row, so a spike cannot dampen its own score
+    trailing = ordered.rows_between(-spike_window, -1)
+    whole_series = Window.partition_by(*series)
+
+    # 2. All checks are window expressions over the same scan
+    # Explicit casts: without them Snowpark's local testing backend cannot evaluate abs()/greatest() over windows
+    prev_stock = F.lag(F.col(stock_col)).over(ordered).cast("double")
+    expected_stock = prev_stock - F.coalesce(F.col(qty_col), F.lit(0))
+    tolerance = F.greatest(F.lit(float(tolerance_units)), F.abs(prev_stock) * F.lit(tolerance_pct))
+    trailing_mean = F.avg(F.col(qty_col)).over(trailing).cast("double")
+    trailing_std = F.stddev(F.col(qty_col)).over(trailing).cast("double")
+    trailing_n = F.count(F.col(qty_col)).over(trailing)
+
+    checked = df.select(
+        F.col(date_col).alias("DATE"),
+        F.col(item_col).alias("ITEM_NAME"),
+        region.alias("REGION"),
+        F.col(qty_col).cast("double").alias("QUANTITY_USED"),
+        # Tested on the raw column: the local testing backend casts a NULL integer to NaN, not NULL
+        F.col(qty_col).is_null().alias("MISSING_USAGE"),
+        F.col(stock_col).cast("double").alias("STOCK_REMAINING"),
+        expected_stock.cast("double").alias("EXPECTED_STOCK"),
+        # Flag only, so no TOLERANCE column: the local testing backend types greatest() as non-nullable
+        # and then refuses to cache the NULL it gives for each series' first row
+        F.coalesce(F.abs(F.col(stock_col) - expected_stock) > tolerance, F.lit(False)).alias("LEDGER_MISMATCH"),
+        # CASE without ELSE (NULL for short or constant histories); the zero std-dev is nulled before dividing,
+        # since the local testing backend evaluates the division for every row, not just the matched ones
+        F.when(
+            trailing_n >= F.lit(7),
+            (F.col(qty_col) - trailing_mean) / F.when(trailing_std > F.lit(0), trailing_std),
+        ).cast("double").alias("USAGE_Z"),
+        F.datediff("day", F.max(F.col(date_col)).over(whole_series), F.max(F.col(date_col)).over()).alias("DAYS_SILENT"),
+        F.lead(F.col(date_col)).over(ordered).is_null().alias("IS_LAST"),
+    )
+
+    flagged = checked.with_column(
+        "NEGATIVE_STOCK", F.coalesce(F.col("STOCK_REMAINING") < 0, F.lit(False))
+    ).with_column(
+        # Two-sided bound instead of abs(): the local testing backend cannot take abs() of an all-NULL column
+        "USAGE_SPIKE", F.coalesce((F.col("USAGE_Z") > F.lit(z_threshold)) | (F.col("USAGE_Z") < F.lit(-z_threshold)), F.lit(False))
+    ).with_column(
+        "STALE_SERIES", F.col("IS_LAST") & (F.col("DAYS_SILENT") >= F.lit(stale_days))
+    )
+
+    # 3. Materialize only the flagged rows; the per-type split below re-reads this small set, not the input
+    flagged = flagged.filter(
+        F.col("LEDGER_MISMATCH") | F.col("MISSING_USAGE") | F.col("NEGATIVE_STOCK") | F.col("USAGE_SPIKE") | F.col("STALE_SERIES")
+    ).cache_result()
+
+    def anomaly(flag, observed, expected, score, detail):
+        return flagged.filter(F.col(flag)).select(
+            "DATE", "ITEM_NAME", "REGION",
+            F.lit(flag).alias("ANOMALY_TYPE"),
+            observed.cast("double").alias("OBSERVED"),
+            expected.cast("double").alias("EXPECTED"),
+            score.cast("double").alias("SCORE"),
+            detail.alias("DETAIL"),
+        )
+
+    parts = [
+        anomaly("LEDGER_MISMATCH", F.col("STOCK_REMAINING"), F.col("EXPECTED_STOCK"),
+                F.abs(F.col("STOCK_REMAINING") - F.col("EXPECTED_STOCK")),
+                F.lit("Stock movement does not match recorded usage")),
+        anomaly("MISSING_USAGE", F.col("STOCK_REMAINING"), F.lit(None), F.lit(None),
+                F.lit("Usage not recorded for this day")),
+        anomaly("NEGATIVE_STOCK", F.col("STOCK_REMAINING"), F.lit(0), F.abs(F.col("STOCK_REMAINING")),
+                F.lit("Stock below zero")),
+        anomaly("USAGE_SPIKE", F.col("QUANTITY_USED"), F.lit(None), F.col("USAGE_Z"),
+                F.lit(f"Usage beyond {z_threshold} std-devs of the trailing {spike_window} days")),
+        anomaly("STALE_SERIES", F.col("DAYS_SILENT"), F.lit(0), F.col("DAYS_SILENT"),
+                F.lit("No new records since this date")),
+    ]
+    result = parts[0]
+    for part in parts[1:]:
+        result = result.union_all(part)
+    return result
+
+# Weather severity -> (demand factor, lead-time factor) applied to days inside an event window
+WEATHER_SEVERITY_FACTORS = {
+    "LOW": (1.05, 1.1),
+    "MEDIUM": (1.15, 1.25),
+    "HIGH": (1.3, 1.5),
+    "CRITICAL": (1.5, 2.0),
+}
+
+def weather_adjusted_horizon(session, forecast_table_name="FORECAST_RESULTS", weather_table_name="WEATHER_SAMPLE",
+                             horizon_days=7, window_before=1, window_after=2, base_lead_time_days=3):
+    """
+    Joins weather events onto the forecast horizon of every item-region, set-wise:
+    each event is expanded over its window (event date - window_before .. + window_after),
+    collapsed to one impact row per (region, day), then equi-joined onto the horizon days.
+    Returns one row per (item, region, horizon day) with demand / lead-time factors,
+    the adjusted forecast, projected stock and an AT_RISK flag.
+    """
+    # 1. Horizon days: starting from the latest row per item-region (or today, if history is older)
+    series = Window.partition_by("ITEM_NAME", "REGION")
+    latest = session.table(forecast_table_name).with_column(
+        "LAST_DATE", F.max(F.col("DATE")).over(series)
+    ).filter(F.col("DATE") == F.col("LAST_DATE")).select(
+        "ITEM_NAME", "REGION",
+        F.col("FORECAST_NEXT_7_DAYS").alias("BASE_FORECAST"),
+        F.col("STOCK_REMAINING").alias("START_STOCK"),
+        F.greatest(F.col("DATE"), F.current_date()).alias("ANCHOR_DATE"),
+    )
+    horizon = session.create_dataframe([[h] for h in range(1, horizon_days + 1)], schema=["HORIZON"])
+    days = latest.cross_join(horizon).with_column(
+        "FORECAST_DATE", F.dateadd("day", F.col("HORIZON"), F.col("ANCHOR_DATE"))
+    )
+
+    # 2. Weather impact per (region, day). Horizons start tomorrow at the earliest, so older events are pruned first.
+    severity = session.create_dataframe(
+        [[name, demand, lead] for name, (demand, lead) in WEATHER_SEVERITY_FACTORS.items()],
+        schema=["SEVERITY_KEY", "EVENT_DEMAND_FACTOR", "EVENT_LEAD_TIME_FACTOR"],
+    )
+    offsets = session.create_dataframe([[o] for o in range(-window_before, window_after + 1)], schema=["OFFSET_DAYS"])
+    # Only events whose window can touch a horizon day (tomorrow .. latest anchor + horizon_days)
+    last_day = latest.agg(F.max(F.col("ANCHOR_DATE")).alias("LAST_ANCHOR")).collect()[0]["LAST_ANCHOR"]
+    events = session.table(weather_table_name).filter(
+        (F.col("EVENT_DATE") >= F.dateadd("day", F.lit(1 - window_after), F.current_date()))
+        & (F.col("EVENT_DATE") <= F.dateadd("day", F.lit(horizon_days + window_before), F.lit(last_day)))
+    )
+    impact = events.join(severity, F.upper(F.col("SEVERITY")) == severity["SEVERITY_KEY"]).cross_join(offsets).select(
+        F.col("REGION").alias("EVENT_REGION"),
+        F.dateadd("day", F.col("OFFSET_DAYS"), F.col("EVENT_DATE")).alias("IMPACT_DATE"),
+        "EVENT_DEMAND_FACTOR", "EVENT_LEAD_TIME_FACTOR", "EVENT_TYPE",
+    ).group_by("EVENT_REGION", "IMPACT_DATE").agg(
+        F.max(F.col("EVENT_DEMAND_FACTOR")).alias("EVENT_DEMAND_FACTOR"),
+        F.max(F.col("EVENT_LEAD_TIME_FACTOR")).alias("EVENT_LEAD_TIME_FACTOR"),
+        F.listagg(F.col("EVENT_TYPE"), ", ", is_distinct=True).alias("WEATHER_EVENTS"),
+    )
+
+    # 3. Adjust the horizon and project stock day by day
+    joined = days.join(
+        impact, (days["REGION"] == impact["EVENT_REGION"]) & (days["FORECAST_DATE"] == impact["IMPACT_DATE"]), "left"
+    ).with_column(
+        "DEMAND_FACTOR", F.coalesce(F.col("EVENT_DEMAND_FACTOR"), F.lit(1.0))
+    ).with_column(
+        "LEAD_TIME_FACTOR", F.coalesce(F.col("EVENT_LEAD_TIME_FACTOR"), F.lit(1.0))
+    ).with_column(
+        "ADJUSTED_FORECAST", F.col("BASE_FORECAST") * F.col("DEMAND_FACTOR")
+    )
+    running = Window.partition_by("ITEM_NAME", "REGION").order_by("HORIZON") \
+        .rows_between(Window.UNBOUNDED_PRECEDING, Window.CURRENT_ROW)
+    projected = joined.with_column(
+        "PROJECTED_STOCK", F.col("START_STOCK") - F.sum(F.col("ADJUSTED_FORECAST")).over(running)
+    ).with_column(
+        # Worst disruption in the horizon stretches how long a resupply ordered today would take
+        "EFFECTIVE_LEAD_TIME_DAYS", F.lit(base_lead_time_days) * F.max(F.col("LEAD_TIME_FACTOR")).over(series)
+    )
+    return projected.select(
+        "ITEM_NAME", "REGION", "FORECAST_DATE", "HORIZON",
+        F.col("BASE_FORECAST").cast("double").alias("BASE_FORECAST"),
+        F.col("DEMAND_FACTOR").cast("double").alias("DEMAND_FACTOR"),
+        F.col("LEAD_TIME_FACTOR").cast("double").alias("LEAD_TIME_FACTOR"),
+        F.col("ADJUSTED_FORECAST").cast("double").alias("ADJUSTED_FORECAST"),
+        F.col("PROJECTED_STOCK").cast("double").alias("PROJECTED_STOCK"),
+        F.col("EFFECTIVE_LEAD_TIME_DAYS").cast("double").alias("EFFECTIVE_LEAD_TIME_DAYS"),
+        ((F.col("PROJECTED_STOCK") <= 0) & (F.col("HORIZON") <= F.col("EFFECTIVE_LEAD_TIME_DAYS"))).alias("AT_RISK"),
+        "WEATHER_EVENTS",
+    )
+
+def replace_table_contents(session, df, table_name, clustering_keys):
+    """
+    Swaps the rows of `table_name` for the rows of `df` in one INSERT OVERWRITE, written straight from
+    the DataFrame's query and sorted on the clustering keys, so fresh rows land already clustered.
+    The table object itself (grants, clustering key, dependent views) is never dropped;
+    it is only created, already clustered, when missing (e.g. in Local Mode).
+    Returns the target table as a DataFrame.
+    """
+    keys = list(clustering_keys)
+    if not data_quality.table_exists(session, table_name):
+        df.sort(*keys).write.save_as_table(table_name, clustering_keys=keys)
+        return session.table(table_name)
+    plan = df.queries
+    # Earlier queries only set up the final one (e.g. temp tables for in-memory data)
+    for query in plan["queries"][:-1]:
+        session.sql(query).collect()
+    columns = ", ".join(df.columns)
+    try:
+        session.sql(
+            f"INSERT OVERWRITE INTO {table_name} ({columns}) "
+            f"SELECT {columns} FROM ({plan['queries'][-1]}) ORDER BY {', '.join(keys)}"
+        ).collect()
+    finally:
+        for query in plan["post_actions"]:
+            session.sql(query).collect()
+    return session.table(table_name)
+
 # The Stored Procedure Entry Point
-def main(session, input_table_name, date_col, item_col, qty_col):
+def main(session, input_table_name, date_col, item_col, qty_col, method=DEFAULT_METHOD, weather_table_name="WEATHER_SAMPLE"):
     # Call the logic function
-    result_df = calculate_forecast(session, input_table_name, date_col, item_col, qty_col)
+    result_df = calculate_forecast(session, input_table_name, date_col, item_col, qty_col, method)
+
+    # Fixed result schema, whatever the input columns are called (REGION / STOCK are optional inputs)
+    present = [c.strip('"').upper() for c in result_df.columns]
+    optional = lambda name: F.col(name) if name in present else F.lit(None)
+    result_df = result_df.select(
+        F.col(date_col).alias("DATE"),
+        F.col(item_col).alias("ITEM_NAME"),
+        optional("REGION").cast("string").alias("REGION"),
+        F.col(qty_col).cast("integer").alias("QUANTITY_USED"),
+        F.col("FORECAST_NEXT_7_DAYS").cast("double").alias("FORECAST_NEXT_7_DAYS"),
+        optional("STOCK_REMAINING").cast("integer").alias("STOCK_REMAINING"),
+        F.col("FORECAST_METHOD"),
+        # Lets the Dashboard show the quality profile of this input, not of whichever table was profiled last
+        F.lit(input_table_name).alias("SOURCE_TABLE"),
+    )
     
-    # Materialize the result to a temporary table for the UI to query efficiently
-    # The UI will read from this 'RESULT_CACHE' table.
+    # Materialize the result into the clustered table created by setup_script.sql.
+    # INSERT OVERWRITE keeps the table, its grants and the views on top of it, so no GRANT is re-issued
+    # and per-item / date-range queries keep pruning on (ITEM_NAME, DATE).
     result_table_name = "FORECAST_RESULTS"
-    result_df.write.mode("overwrite").save_as_table(result_table_name)
-    
-    # CRITICAL: save_as_table("overwrite") drops and recreates the table, losing the initial grants.
-    # We must re-grant SELECT to the application role so the Streamlit app can read it.
-    session.sql(f"GRANT SELECT ON TABLE {result_table_name} TO APPLICATION ROLE app_public").collect()
+    if data_quality.table_exists(session, result_table_name):
+        # Tables created by earlier Local Mode runs or uploads predate the column
+        session.sql(f"ALTER TABLE {result_table_name} ADD COLUMN IF NOT EXISTS SOURCE_TABLE VARCHAR").collect()
+    replace_table_contents(session, result_df, result_table_name, ["ITEM_NAME", "DATE"])
+
+    # Anomaly stage: runs on the raw input (before NULL filling) so missing usage stays visible
+    anomaly_table_name = "INVENTORY_ANOMALIES"
+    try:
+        anomalies_df = detect_anomalies(session, input_table_name, date_col, item_col, qty_col)
+        written = replace_table_contents(session, anomalies_df, anomaly_table_name, ["ITEM_NAME", "DATE"])
+        anomaly_note = f" ({written.count()} anomalies flagged)"
+    except Exception as e:
+        anomaly_note = f" (Anomaly scan skipped: {e})"
+
+    # Weather feature stage: precompute weather-adjusted demand and risk once per refresh
+    horizon_table_name = "FORECAST_HORIZON"
+    try:
+        horizon_df = weather_adjusted_horizon(session, result_table_name, weather_table_name)
+        written = replace_table_contents(session, horizon_df, horizon_table_name, ["ITEM_NAME", "FORECAST_DATE"])
+        weather_note = f" ({written.filter(F.col('DEMAND_FACTOR') > 1).count()} weather-affected forecast days)"
+    except Exception as e:
+        weather_note = f" (Weather stage skipped: {e})"
+
+    # Refresh the data-quality profile of the input (incremental when only new dates arrived).
+    # Profiling is advisory, so a failure here must not fail the forecast itself.
+    try:
+        stats = data_quality.refresh_quality_stats(session, input_table_name, date_col, item_col, qty_col)
+        quality_note = f" (Data quality: {stats['QUALITY_SCORE']}%)"
+    except Exception as e:
+        quality_note = f" (Data quality profile skipped: {e})"
     
-    return f"Success: Forecast generated in {result_table_name}"
+    return f"Success: Forecast generated in {result_table_name}{anomaly_note}{weather_note}{quality_note}"
@@ -0,0 +1,258 @@
+# 12. The Governance Layer (Admission Control + Statement Limits)
+# Objective: Keep a few heavy clicks (ad-hoc SQL, Cortex, batch jobs) from saturating the warehouse
+# and blocking the Dashboard for everyone.
+# Architecture: Every statement the UI sends belongs to a query class with its own timeout, priority and
+# concurrency cap. One process-wide Governor admits statements through per-user and global slots, always
+# serving the highest-priority waiter first and holding back slots for interactive reads. Ad-hoc SQL is
+# costed with EXPLAIN (compile only, no warehouse time) before it may run. FakeSession stands in for
+# Snowpark so the whole layer can be exercised offline.
+
+import collections
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+
+class AdmissionError(Exception):
+    """The statement was not admitted (limits reached or queue wait expired)."""
+
+
+class CostLimitError(AdmissionError):
+    """EXPLAIN says the ad-hoc statement would scan more than its class allows."""
+
+
+class QueryClass:
+    """Limits for one kind of statement. Lower priority numbers are admitted first."""
+
+    def __init__(self, name, timeout_s, priority, max_concurrency=None, queue_timeout_s=30,
+                 max_rows=None, max_scan_bytes=None):
+        self.name = name
+        self.timeout_s = timeout_s
+        self.priority = priority
+        self.max_concurrency = max_concurrency # None = only the global limit applies
+        self.queue_timeout_s = queue_timeout_s
+        self.max_rows = max_rows # Result cap (ad-hoc SQL)
+        self.max_scan_bytes = max_scan_bytes # EXPLAIN budget (ad-hoc SQL)
+
+    def statement_params(self):
+        # Sent with each statement, so concurrent users sharing a session do not race on ALTER SESSION
+        return {"STATEMENT_TIMEOUT_IN_SECONDS": self.timeout_s, "QUERY_TAG": f"aidops:{self.name}"}
+
+    def session_sql(self):
+        # Same limits for a whole block of work (charts, local jobs) that issues many statements
+        return f"ALTER SESSION SET STATEMENT_TIMEOUT_IN_SECONDS = {self.timeout_s} QUERY_TAG = 'aidops:{self.name}'"
+
+
+# Dashboard reads: short, first in line, and the only class allowed into the reserved slots
+INTERACTIVE = QueryClass("INTERACTIVE", timeout_s=60, priority=0, queue_timeout_s=60)
+# Cortex COMPLETE calls (AI Analyst, Commander Chat)
+CORTEX = QueryClass("CORTEX", timeout_s=120, priority=1, max_concurrency=2)
+# SQL Runner: costed first, results capped
+ADHOC = QueryClass("ADHOC", timeout_s=60, priority=1, max_concurrency=2,
+                   max_rows=1000, max_scan_bytes=10 * 1024 ** 3)
+# Stored procedure runs (forecast, backtest, daily briefings)
+JOB = QueryClass("JOB", timeout_s=1800, priority=2, max_concurrency=1, queue_timeout_s=10)
+
+
+class Governor:
+    """
+    Admission control for the whole Streamlit process. A statement needs a per-user slot and
+    a global slot; `reserved` global slots are kept free for priority-0 (interactive) classes.
+    Waiters are served by priority, then arrival order, skipping ones whose class is at its cap.
+    """
+
+    def __init__(self, global_limit=4, per_user_limit=2, reserved=1):
+        self.global_limit = global_limit
+        self.per_user_limit = per_user_limit
+        self.reserved = reserved
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting = [] # (priority, seq, query_class)
+        self.running = 0
+        self.running_by_class = collections.Counter()
+        self.in_flight_by_user = collections.Counter() # Queued + running
+
+    def _has_room(self, query_class):
+        limit = self.global_limit if query_class.priority == 0 else self.global_limit - self.reserved
+        if self.running >= limit:
+            return False
+        cap = query_class.max_concurrency
+        return cap is None or self.running_by_class[query_class.name] < cap
+
+    def _is_next(self, ticket):
+        # First waiter (by priority, then arrival) that could run right now
+        for waiter in sorted(self._waiting, key=lambda w: (w[0], w[1])):
+            if self._has_room(waiter[2]):
+                return waiter is ticket
+        return False
+
+    def _release_user(self, user):
+        self.in_flight_by_user[user] -= 1
+        if not self.in_flight_by_user[user]:
+            del self.in_flight_by_user[user] # Keep the counter bounded by active users
+
+    @contextlib.contextmanager
+    def slot(self, query_class, user="anonymous", session=None):
+        """
+        Holds one admission slot for the duration of the block; raises AdmissionError on timeout.
+        With `session`, the class timeout and query tag are set on that session for the block and
+        unset afterwards, so every statement the block issues is limited. Session parameters are
+        shared by everything on the session: pass only a session owned by the calling user.
+        """
+        deadline = time.monotonic() + query_class.queue_timeout_s
+        with self._cond:
+            # 1. Per-user limit (counts queued statements too, so one user cannot flood the queue)
+            while self.in_flight_by_user[user] >= self.per_user_limit:
+                if not self._cond.wait(max(deadline - time.monotonic(), 0)):
+                    raise AdmissionError(f"{user} already has {self.per_user_limit} statements in flight")
+            self.in_flight_by_user[user] += 1
+
+            # 2. Global slot, in priority order
+            ticket = (query_class.priority, next(self._seq), query_class)
+            self._waiting.append(ticket)
+            while not self._is_next(ticket):
+                if not self._cond.wait(max(deadline - time.monotonic(), 0)):
+                    self._waiting.remove(ticket)
+                    self._release_user(user)
+                    self._cond.notify_all()
+                    raise AdmissionError(f"Warehouse busy: {query_class.name} statement waited {query_class.queue_timeout_s}s")
+            self._waiting.remove(ticket)
+            self.running += 1
+            self.running_by_class[query_class.name] += 1
+        try:
+            if session is None:
+                yield
+            else:
+                session.sql(query_class.session_sql()).collect()
+                try:
+                    yield
+                finally:
+                    session.sql("ALTER SESSION UNSET STATEMENT_TIMEOUT_IN_SECONDS, QUERY_TAG").collect()
+        finally:
+            with self._cond:
+                self.running -= 1
+                self.running_by_class[query_class.name] -= 1
+                self._release_user(user)
+                self._cond.notify_all()
+
+    def sql(self, session, query, query_class, user="anonymous"):
+        """Runs one SQL statement under the class limits and returns its rows (capped at max_rows)."""
+        if query_class.max_scan_bytes is not None:
+            check_cost(session, query, query_class)
+        with self.slot(query_class, user):
+            result = session.sql(query)
+            params = query_class.statement_params()
+            if query_class.max_rows is None:
+                return result.collect(statement_params=params)
+            # Stream rows and stop at the cap instead of pulling the whole result
+            return list(itertools.islice(result.to_local_iterator(statement_params=params), query_class.max_rows))
+
+    def to_pandas(self, df, query_class, user="anonymous"):
+        """DataFrame read under the class limits."""
+        with self.slot(query_class, user):
+            return df.to_pandas(statement_params=query_class.statement_params())
+
+
+def estimate_cost(session, query):
+    """
+    Scan estimate from EXPLAIN (compiled, not executed): partitions and bytes the query would read.
+    Returns None when the statement cannot be explained (e.g. DDL, SHOW).
+    """
+    try:
+        row = session.sql(f"EXPLAIN USING JSON {query.strip().rstrip(';')}").collect()[0]
+        stats = json.loads(row[0]).get("GlobalStats", {})
+    except Exception:
+        return None
+    return dict(
+        partitions_total=stats.get("partitionsTotal", 0),
+        partitions_assigned=stats.get("partitionsAssigned", 0),
+        bytes_assigned=stats.get("bytesAssigned", 0),
+    )
+
+
+def check_cost(session, query, query_class):
+    """Raises CostLimitError if the estimate exceeds the class budget; returns the estimate."""
+    cost = estimate_cost(session, query)
+    if cost is not None and cost["bytes_assigned"] > query_class.max_scan_bytes:
+        raise CostLimitError(
+            f"Query would scan {cost['bytes_assigned'] / 1024 ** 3:.1f} GB "
+            f"({cost['partitions_assigned']} of {cost['partitions_total']} partitions); "
+            f"limit is {query_class.max_scan_bytes / 1024 ** 3:.1f} GB. Add a filter or LIMIT."
+        )
+    return cost
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_governor():
+    """Process-wide Governor shared by every Streamlit session (limits from AIDOPS_MAX_QUERIES*)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Governor(
+                global_limit=int(os.environ.get("AIDOPS_MAX_QUERIES", 4)),
+                per_user_limit=int(os.environ.get("AIDOPS_MAX_QUERIES_PER_USER", 2)),
+            )
+        return _default
+
+
+class FakeSession:
+    """
+    Offline stand-in for a Snowpark session: every statement returns `rows` after `delay_s`,
+    EXPLAIN reports `scan_bytes`. Records (query, statement_params) in `.executed` and the peak
+    number of concurrently running statements in `.max_active`, for assertions.
+    """
+
+    def __init__(self, rows=None, delay_s=0.0, scan_bytes=0):
+        self.rows = rows if rows is not None else []
+        self.delay_s = delay_s
+        self.scan_bytes = scan_bytes
+        self.executed = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def sql(self, query):
+        return _FakeResult(self, query)
+
+    def _run(self, query, statement_params):
+        if query.upper().startswith("EXPLAIN"):
+            stats = {"GlobalStats": {"partitionsTotal": 1, "partitionsAssigned": 1, "bytesAssigned": self.scan_bytes}}
+            return [(json.dumps(stats),)]
+        if query.upper().startswith("ALTER SESSION"):
+            with self._lock:
+                self.executed.append((query, statement_params))
+            return []
+        with self._lock:
+            self.executed.append((query, statement_params))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            if self.delay_s:
+                time.sleep(self.delay_s)
+            return list(self.rows)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+class _FakeResult:
+    def __init__(self, session, query):
+        self.session = session
+        self.query = query
+
+    def collect(self, statement_params=None):
+        return self.session._run(self.query, statement_params)
+
+    def to_local_iterator(self, statement_params=None):
+        return iter(self.collect(statement_params))
+
+    def to_pandas(self, statement_params=None):
+        return pd.DataFrame(self.collect(statement_params))
@@ -0,0 +1,197 @@
+# 9. The Local Snapshot Cache (Local / Hybrid Mode only)
+# Objective: Stop pulling whole result tables over the network on every Streamlit rerun.
+# Architecture: Each table is kept on disk as uncompressed Arrow IPC segments that are memory-mapped on read.
+# New rows are delta-synced by DATE high-water mark; a server-side HASH_AGG of the already-synced
+# rows detects rewrites (e.g. a forecast refresh), which trigger a full resync instead.
+
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+import snowflake.snowpark.functions as F
+
+import data_quality
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError: # Optional: without pyarrow the app reads straight from Snowflake
+    pa = None
+
+CACHE_DIR = os.environ.get("AIDOPS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".aidops", "cache"))
+CATEGORY_COLUMNS = ("ITEM_NAME", "REGION", "SOURCE_TABLE")
+MAX_SEGMENTS = 8 # Compact into a single file once this many deltas pile up
+CHECK_INTERVAL_S = 30 # Reruns inside this window skip even the version check
+
+_locks = {}
+_last_check = {}
+
+
+def available():
+    return pa is not None
+
+
+def _table_dir(table_name):
+    safe = "".join(c if c.isalnum() else "_" for c in table_name.upper())
+    return os.path.join(CACHE_DIR, safe)
+
+
+def _read_manifest(path):
+    try:
+        with open(os.path.join(path, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(path, manifest):
+    tmp = os.path.join(path, "manifest.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(path, "manifest.json")) # Atomic swap, readers never see half a manifest
+
+
+def _compact_types(df):
+    """Downcast numerics (ints to int32 at the smallest, so app arithmetic cannot overflow) and mark categories."""
+    for col in df.columns:
+        if col in CATEGORY_COLUMNS:
+            df[col] = df[col].astype("category")
+        elif pd.api.types.is_integer_dtype(df[col]):
+            if df[col].abs().max() < 2 ** 31:
+                df[col] = df[col].astype("Int32" if df[col].hasnans else "int32")
+        elif pd.api.types.is_float_dtype(df[col]):
+            df[col] = df[col].astype("float32")
+    return df
+
+
+def _to_arrow(df):
+    table = pa.Table.from_pandas(_compact_types(df), preserve_index=False)
+    # Fixed int32 dictionary indices so segments with different category counts share one schema
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.dictionary(pa.int32(), pa.string())))
+    return table
+
+
+def _write_segment(path, table):
+    name = f"part-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}.arrow"
+    # Uncompressed IPC file: can be memory-mapped and read without decoding
+    with pa.OSFile(os.path.join(path, name), "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return name
+
+
+def _open_segments(path, segments):
+    tables = [ipc.open_file(pa.memory_map(os.path.join(path, s), "r")).read_all() for s in segments]
+    return pa.concat_tables(tables) if len(tables) > 1 else tables[0]
+
+
+def sync(session, table_name, date_col="DATE", force=False):
+    """
+    Brings the local snapshot of `table_name` up to date and returns its manifest.
+    Only rows after the stored high-water mark cross the network, unless the older rows changed.
+    """
+    path = _table_dir(table_name)
+    lock = _locks.setdefault(table_name, threading.Lock())
+    with lock:
+        os.makedirs(path, exist_ok=True)
+        manifest = _read_manifest(path)
+
+        # 1. Nothing to do if the table has not changed since the last sync
+        version = data_quality.table_version(session, table_name)
+        if manifest and not force and version is not None and manifest["version"] == version:
+            return manifest
+
+        # 2. Delta sync: verify the synced prefix is untouched, then fetch only newer rows
+        if manifest and not force and manifest["hwm"] is not None:
+            rows, digest = data_quality.prefix_fingerprint(session, table_name, date_col, manifest["hwm"])
+            if rows == manifest["rows"] and digest == manifest["hash"]:
+                delta = session.table(table_name).filter(F.col(date_col) > F.lit(manifest["hwm"])).to_pandas()
+                if not delta.empty:
+                    schema = _open_segments(path, manifest["segments"][:1]).schema
+                    try:
+                        table = _to_arrow(delta).cast(schema)
+                    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, ValueError):
+                        table = None # New values do not fit the stored types: fall through to a full resync
+                    if table is not None:
+                        manifest["segments"].append(_write_segment(path, table))
+                        manifest["hwm"] = str(delta[date_col].max())
+                        manifest["rows"], manifest["hash"] = data_quality.prefix_fingerprint(session, table_name, date_col, manifest["hwm"])
+                        manifest["version"] = version
+                        old_segments = []
+                        if len(manifest["segments"]) > MAX_SEGMENTS:
+                            old_segments = manifest["segments"]
+                            manifest["segments"] = [_write_segment(path, _open_segments(path, old_segments).combine_chunks())]
+                        _write_manifest(path, manifest)
+                        _remove(path, old_segments) # Only after the manifest stops pointing at them
+                        return manifest
+                else:
+                    manifest["version"] = version
+                    _write_manifest(path, manifest)
+                    return manifest
+
+        # 3. Full sync: first run, forced, or rewritten history
+        df = session.table(table_name).to_pandas()
+        table = _to_arrow(df)
+        old_segments = manifest["segments"] if manifest else []
+        hwm = str(df[date_col].max()) if not df.empty else None
+        rows, digest = data_quality.prefix_fingerprint(session, table_name, date_col, hwm) if hwm else (0, None)
+        manifest = {
+            "table": table_name,
+            "version": version,
+            "hwm": hwm,
+            "rows": rows,
+            "hash": digest,
+            "segments": [_write_segment(path, table)],
+        }
+        _write_manifest(path, manifest)
+        _remove(path, old_segments)
+        return manifest
+
+
+def _remove(path, segments):
+    for s in segments:
+        try:
+            os.remove(os.path.join(path, s))
+        except OSError:
+            pass # Still memory-mapped by another session on some platforms; harmless leftover
+
+
+def read_arrow(table_name):
+    """Memory-mapped Arrow table of the snapshot (no copy), or None if nothing is cached yet."""
+    path = _table_dir(table_name)
+    manifest = _read_manifest(path)
+    if not manifest or not manifest["segments"]:
+        return None
+    return _open_segments(path, manifest["segments"])
+
+
+def load(session, table_name, date_col="DATE", guard=contextlib.nullcontext):
+    """
+    Returns the table as pandas, served from the local snapshot.
+    The warehouse is asked for changes at most once every CHECK_INTERVAL_S seconds; only that sync
+    runs inside `guard()` (e.g. an admission slot), reads served from disk never touch the warehouse.
+    Numeric columns are backed by the read-only memory map; add new columns rather than editing in place.
+    """
+    now = time.time()
+    if now - _last_check.get(table_name, 0) > CHECK_INTERVAL_S or read_arrow(table_name) is None:
+        with guard():
+            sync(session, table_name, date_col)
+        _last_check[table_name] = now
+    table = read_arrow(table_name)
+    return table.to_pandas(split_blocks=True) if table is not None else pd.DataFrame()
+
+
+def snapshot_info(table_name):
+    """Manifest plus on-disk size, for display."""
+    path = _table_dir(table_name)
+    manifest = _read_manifest(path)
+    if not manifest:
+        return None
+    size = sum(os.path.getsize(os.path.join(path, s)) for s in manifest["segments"] if os.path.exists(os.path.join(path, s)))
+    return dict(manifest, bytes=size)
@@ -6,13 +6,22 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import snowflake.snowpark.functions as F
 from datetime import datetime
 import sys
 import os
+import uuid
 
 # Add local src directory to path so we can import logic
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import forecast_logic
+import data_quality
+import chart_data
+import backtest
+import local_cache
+import cortex_chat
+import briefings
+import governance
 
 # --- 1. SETUP & STYLING ---
 # GENERIC LOGO: Box 📦 serves best for 'Supply/Logistics' across any industry.
@@ -48,6 +57,22 @@ def get_snowflake_session():
 
 session = get_snowflake_session()
 
+# Admission control shared by every user of this app process (see governance.py)
+governor = governance.default_governor()
+
+def current_user():
+    # Snowflake user name when Streamlit exposes it, otherwise one id per browser session
+    try:
+        name = st.experimental_user.get("user_name")
+        if name:
+            return name
+    except Exception:
+        pass
+    if 'governance_user' not in st.session_state:
+        # st.session_state is one module-level proxy, so its id() would be shared by every browser session
+        st.session_state.governance_user = f"session-{uuid.uuid4().hex}"
+    return st.session_state.governance_user
+
 # Custom CSS for "Premium" Look
 st.markdown("""
 <style>
@@ -104,10 +129,88 @@ if 'sector' not in st.session_state:
     st.session_state.sector = "Healthcare (Medicines)"
 
 # --- 3. HELPER FUNCTIONS ---
-def get_data():
+# Tables mirrored to the on-disk snapshot in Local Mode (see local_cache.py); only tables the UI reads
+SNAPSHOT_TABLES = ["core.FORECAST_RESULTS"]
+
+def warehouse_busy(e):
+    # Not admitted by the governor: say so and end this run, rather than treating the read as "no data"
+    st.warning(f"⏳ Warehouse busy, please retry in a moment. ({e})")
+    st.stop()
+
+def get_data(use_snapshot=True):
+    # Local Mode: serve reruns from the memory-mapped snapshot, only deltas cross the network
+    if use_snapshot and st.session_state.is_local and local_cache.available():
+        try:
+            # Admission (and the session timeout) only for the sync that queries the warehouse
+            return local_cache.load(session, "core.FORECAST_RESULTS",
+                                    guard=lambda: governor.slot(governance.INTERACTIVE, current_user(), session))
+        except governance.AdmissionError as e:
+            warehouse_busy(e)
+        except Exception as e:
+            # A broken snapshot must not look like an empty table (that would re-run the forecast)
+            st.warning(f"Local snapshot unavailable, reading from Snowflake instead: {e}")
     try:
         # If local, we can read directly if permissions allow, or mock
-        return session.table("core.FORECAST_RESULTS").to_pandas()
+        return governor.to_pandas(session.table("core.FORECAST_RESULTS"), governance.INTERACTIVE, current_user())
+    except governance.AdmissionError as e:
+        warehouse_busy(e)
+    except Exception as e:
+        return pd.DataFrame()
+
+def get_anomalies():
+    # Precomputed by the anomaly stage in forecast_logic (one row per flagged record)
+    try:
+        return governor.to_pandas(session.table("core.INVENTORY_ANOMALIES"), governance.INTERACTIVE, current_user())
+    except governance.AdmissionError as e:
+        warehouse_busy(e)
+    except Exception as e:
+        return pd.DataFrame()
+
+def get_latest(df):
+    # Latest row per item from the pruned view (setup_script.sql); pandas fallback in Local Mode
+    if not st.session_state.is_local:
+        try:
+            return governor.to_pandas(session.table("core.FORECAST_LATEST"), governance.INTERACTIVE, current_user())
+        except Exception as e:
+            pass # Also when busy: the fallback below derives the same rows from df without a query
+    return df.sort_values(by='DATE', ascending=True).groupby('ITEM_NAME').tail(1)
+
+def get_accuracy():
+    # Rolling-origin scores written by backtest.py (one row per item, method and horizon)
+    try:
+        return governor.to_pandas(session.table("core.FORECAST_ACCURACY"), governance.INTERACTIVE, current_user())
+    except governance.AdmissionError as e:
+        warehouse_busy(e)
+    except Exception as e:
+        return pd.DataFrame()
+
+def weather_impact_context(limit=15):
+    # One line per weather-affected item-region from core.FORECAST_HORIZON (worst first)
+    horizon_df = session.table("core.FORECAST_HORIZON").filter(
+        (F.col("DEMAND_FACTOR") > 1) | (F.col("LEAD_TIME_FACTOR") > 1) | F.col("AT_RISK")
+    ).group_by("ITEM_NAME", "REGION").agg(
+        F.max("DEMAND_FACTOR").alias("MAX_DEMAND_FACTOR"),
+        F.max("EFFECTIVE_LEAD_TIME_DAYS").alias("LEAD_TIME_DAYS"),
+        F.min("PROJECTED_STOCK").alias("MIN_PROJECTED_STOCK"),
+        F.max(F.col("AT_RISK").cast("integer")).alias("AT_RISK"),
+        F.listagg(F.col("WEATHER_EVENTS"), ", ", is_distinct=True).alias("EVENTS"),
+    ).sort(F.col("AT_RISK").desc(), F.col("MIN_PROJECTED_STOCK")).limit(limit)
+    horizon = governor.to_pandas(horizon_df, governance.INTERACTIVE, current_user())
+    if horizon.empty:
+        return "No weather events affect the forecast horizon."
+    return horizon.round(2).to_string(index=False)
+
+def anomaly_context(df_anom, limit=10):
+    # Shared with the daily briefing batch (briefings.py)
+    return briefings.anomaly_context(df_anom, limit)
+
+def get_daily_briefings():
+    # Today's precomputed briefings, one row per region and sector (written by briefings.py)
+    try:
+        today = session.table("core.DAILY_BRIEFINGS").filter(F.col("BRIEFING_DATE") == F.current_date())
+        return governor.to_pandas(today, governance.INTERACTIVE, current_user())
+    except governance.AdmissionError as e:
+        warehouse_busy(e)
     except Exception as e:
         return pd.DataFrame()
 
@@ -131,6 +234,20 @@ with st.sidebar:
     # NAVIGATION: Reverted to Standalone Pages
     st.radio("Navigate", ["Home", "Dashboard", "Commander Chat", "AI Analyst", "Data Manager", "Connect Data", "Help & Support"], key="page")
     
+    if st.session_state.is_local and local_cache.available():
+        st.markdown("---")
+        snap = local_cache.snapshot_info("core.FORECAST_RESULTS")
+        if snap:
+            st.caption(f"💾 Local snapshot: {snap['rows']:,} rows · {snap['bytes'] / 1e6:.1f} MB · up to {snap['hwm']}")
+        if st.button("🔄 Sync Snapshot"):
+            with st.spinner("Syncing local snapshot..."):
+                for table_name in SNAPSHOT_TABLES:
+                    try:
+                        with governor.slot(governance.INTERACTIVE, current_user(), session):
+                            local_cache.sync(session, table_name) # Delta sync; falls back to a full one if history changed
+                    except Exception as e:
+                        st.warning(f"Could not sync {table_name}: {e}")
+    
     st.markdown("---")
     st.info("💡 **Hackathon Entry**\nAutomating recurring data chores for public good.")
     st.caption("v1.0 (Final Build)")
@@ -209,8 +326,8 @@ elif st.session_state.page == "Data Manager":
         st.subheader("Option 2: Spreadsheet Editor")
         
         try:
-            # 1. Fetch current data
-            df_current = get_data()
+            # 1. Fetch current data (straight from Snowflake: the snapshot's float32/int32 types would be saved back lossy)
+            df_current = get_data(use_snapshot=False)
             
             if df_current.empty:
                 st.info("No data to edit. Please upload a file first.")
@@ -233,12 +350,19 @@ elif st.session_state.page == "Data Manager":
         default_query = f"SELECT * FROM {target_table} LIMIT 10;"
         sql_query = st.text_area("SQL Query", value=default_query, height=150)
         
+        st.caption(f"Limits: {governance.ADHOC.timeout_s}s timeout, first {governance.ADHOC.max_rows:,} rows, "
+                   f"{governance.ADHOC.max_scan_bytes / 1024 ** 3:.0f} GB scan budget (estimated with EXPLAIN before running).")
+        
         if st.button("▶️ Run Query"):
             try:
-                # Execute arbitrary SQL
-                res_sql = session.sql(sql_query).collect()
+                # Execute arbitrary SQL: costed, timed out and row-capped by the governance layer
+                res_sql = governor.sql(session, sql_query, governance.ADHOC, current_user())
                 st.write(pd.DataFrame(res_sql))
+                if len(res_sql) >= governance.ADHOC.max_rows:
+                    st.caption(f"Showing the first {governance.ADHOC.max_rows:,} rows.")
                 st.success("Query Executed Successfully.")
+            except governance.AdmissionError as e:
+                st.warning(f"Query not run: {e}")
             except Exception as e:
                 st.error(f"SQL Error: {e}")
 
@@ -269,12 +393,32 @@ elif st.session_state.page == "Dashboard":
         else:
              # --- FEATURE 1: DATA HEALTH ---
             with st.expander("🩺 Data Health Audit", expanded=False):
-                null_count = df['QUANTITY_USED'].isnull().sum()
-                neg_count = (df['STOCK_REMAINING'] < 0).sum()
-                h1, h2, h3 = st.columns(3)
-                h1.metric("Missing Records", int(null_count), delta="-Dirty" if null_count > 0 else "Clean", delta_color="inverse")
-                h2.metric("Negative Stock", int(neg_count), delta="-Errors" if neg_count > 0 else "Perfect", delta_color="inverse")
-                h3.caption("Auto-cleaning active.")
+                # Precomputed over the full input table by data_quality.py (refreshed with each forecast run);
+                # the profile must be of the table this forecast was computed from
+                sources = df['SOURCE_TABLE'].dropna() if 'SOURCE_TABLE' in df.columns else pd.Series(dtype=object)
+                health = data_quality.latest_quality_stats(session, sources.iloc[0]) if not sources.empty else None
+                if health is None:
+                    st.caption("No quality profile yet. Run the logic from **Connect Data**.")
+                else:
+                    null_count = health['NULL_QUANTITY']
+                    neg_count = health['NEGATIVE_STOCK']
+                    h1, h2, h3 = st.columns(3)
+                    h1.metric("Missing Records", int(null_count), delta="-Dirty" if null_count > 0 else "Clean", delta_color="inverse")
+                    h2.metric("Negative Stock", int(neg_count), delta="-Errors" if neg_count > 0 else "Perfect", delta_color="inverse")
+                    h3.metric("Quality Score", f"{health['QUALITY_SCORE']:.0f}%")
+                    h3.caption(f"{int(health['DUPLICATE_KEYS'])} duplicate keys, {int(health['DATE_GAPS'])} missing days. Auto-cleaning active.")
+    
+            # --- FEATURE 1b: ANOMALIES ---
+            df_anom = get_anomalies()
+            with st.expander(f"🚨 Inventory Anomalies ({len(df_anom)})", expanded=False):
+                if df_anom.empty:
+                    st.caption("No anomalies flagged in the last run.")
+                else:
+                    counts = df_anom['ANOMALY_TYPE'].value_counts()
+                    a_cols = st.columns(len(counts))
+                    for a_col, (kind, n) in zip(a_cols, counts.items()):
+                        a_col.metric(kind.replace("_", " ").title(), int(n))
+                    st.dataframe(df_anom.sort_values(by=['DATE', 'ITEM_NAME']), use_container_width=True, hide_index=True)
     
             # --- FEATURE 2: SCENARIOS ---
             st.markdown("### 🎛️ Scenario Planner")
@@ -295,21 +439,49 @@ elif st.session_state.page == "Dashboard":
             
             st.divider()
             
-            # Plot
+            # Plot (downsampled in the warehouse, cached per table version; see chart_data.py)
             st.subheader("Forecast Trends")
             items = df['ITEM_NAME'].unique()
-            selected_item = st.selectbox("Inspect Item", items)
-            item_data = df[df['ITEM_NAME'] == selected_item]
+            p1, p2, p3 = st.columns([2, 2, 1])
+            selected_items = p1.multiselect("Inspect Items", items, default=list(items[:1]))
+            date_range = p2.date_input("Date Range", value=(df['DATE'].min(), df['DATE'].max()))
+            split_region = p3.toggle("Split by Region", value=False, disabled='REGION' not in df.columns)
+            start, end = date_range if len(date_range) == 2 else (None, None)
             
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(x=item_data['DATE'], y=item_data['QUANTITY_USED'], mode='lines', name='Actual', line=dict(color='gray')))
-            fig.add_trace(go.Scatter(x=item_data['DATE'], y=item_data['FORECAST_NEXT_7_DAYS'], mode='lines', name='Forecast', line=dict(color='#2E86C1', width=3, dash='dot')))
+            if not selected_items:
+                st.info("Select at least one item to plot.")
+                st.stop()
+            
+            try:
+                with governor.slot(governance.INTERACTIVE, current_user(), session):
+                    fig = chart_data.forecast_chart(
+                        session, "core.FORECAST_RESULTS", selected_items, start=start, end=end,
+                        split_col="REGION" if split_region else None,
+                        version=data_quality.table_version(session, "core.FORECAST_RESULTS"),
+                    )
+            except governance.AdmissionError as e:
+                fig = None # Skip the chart only; the rest of the Dashboard is already loaded
+                st.warning(f"⏳ Chart not loaded, warehouse busy: {e}")
             
-            if restock_sim > 0:
-                fig.add_annotation(x=item_data['DATE'].iloc[-1], y=item_data['FORECAST_NEXT_7_DAYS'].iloc[-1], text=f"+{restock_sim}", showarrow=True)
+            if fig is not None:
+                if restock_sim > 0 and len(selected_items) == 1:
+                    item_data = df[df['ITEM_NAME'] == selected_items[0]].sort_values(by='DATE')
+                    fig.add_annotation(x=item_data['DATE'].iloc[-1], y=item_data['FORECAST_NEXT_7_DAYS'].iloc[-1], text=f"+{restock_sim}", showarrow=True)
+                
+                st.plotly_chart(fig, use_container_width=True)
             
-            fig.update_layout(height=350, margin=dict(l=20, r=20, t=30, b=20), template="plotly_white")
-            st.plotly_chart(fig, use_container_width=True)
+            # --- FEATURE 3: FORECAST ACCURACY (from the last backtest) ---
+            df_acc = get_accuracy()
+            df_acc = df_acc[df_acc['ITEM_NAME'].isin(selected_items)] if not df_acc.empty else df_acc
+            if df_acc.empty:
+                st.caption("No backtest yet. Run one from **Connect Data** to see forecast accuracy.")
+            else:
+                with st.expander("🎯 Forecast Accuracy (Backtest)", expanded=False):
+                    summary = df_acc.groupby(['ITEM_NAME', 'METHOD'], as_index=False).agg(
+                        MAE=('MAE', 'mean'), MAPE=('MAPE', 'mean'), BIAS=('BIAS', 'mean'), BEST=('IS_BEST', 'max')
+                    ).sort_values(by=['ITEM_NAME', 'MAE'])
+                    st.dataframe(summary.round(2), use_container_width=True, hide_index=True)
+                    st.caption("Averaged over all horizons. MAPE in %, BIAS > 0 means the method over-forecasts.")
 
 
 # ----------------- COMMANDER CHAT (Fixed & Standalone) -----------------
@@ -329,46 +501,58 @@ elif st.session_state.page == "Commander Chat":
     </style>
     """, unsafe_allow_html=True)
 
-    # Chat History
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
+    # Chat History: bounded ring + rolling summary (see cortex_chat.py), so reruns render a fixed number of bubbles
+    if "chat_memory" not in st.session_state:
+        # Each fold is a CORTEX statement: same admission slot and timeout as the answers
+        summarizer = None if st.session_state.is_local else cortex_chat.cortex_summarizer(
+            session, run_sql=lambda query: governor.sql(session, query, governance.CORTEX, current_user()))
+        st.session_state.chat_memory = cortex_chat.ChatMemory(summarizer=summarizer)
+    memory = st.session_state.chat_memory
+
+    if memory.summary:
+        with st.expander(f"🗂️ Earlier conversation ({memory.folded} messages summarized)"):
+            st.caption(memory.summary)
 
-    for message in st.session_state.messages:
+    for message in memory.recent:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
     # Chat Input
     if prompt := st.chat_input("Ask for intel..."):
-         st.session_state.messages.append({"role": "user", "content": prompt})
          with st.chat_message("user"):
              st.markdown(prompt)
          
          with st.chat_message("assistant"):
-             with st.spinner("Encrypting transmission..."):
                 try:
                     df = get_data()
                     df_context = df.head(20) if not df.empty else pd.DataFrame()
                     context_str = df_context.to_string(index=False) if not df_context.empty else "No Data"
+                    anomaly_str = anomaly_context(get_anomalies())
                     
-                    system_prompt = f"Role: Logistics Commander. Context: {context_str}. Query: {prompt}. Answer: Short, urgent, military style."
-                    safe_prompt = system_prompt.replace("'", "''")
+                    system_prompt = f"Role: Logistics Commander. Context: {context_str}. Anomalies: {anomaly_str}. Conversation so far: {memory.prompt_memory()}. Query: {prompt}. Answer: Short, urgent, military style."
+                    memory.append("user", prompt)
                     
-                    # Multi-Model Cascade
+                    # Stream the answer into the bubble as it is generated (stub backend for offline runs)
+                    if os.environ.get("AIDOPS_CHAT_BACKEND") == "stub":
+                        backend = cortex_chat.StubBackend()
+                    else:
+                        backend = cortex_chat.CortexBackend(session, timeout_s=governance.CORTEX.timeout_s)
+                    
+                    bubble = st.empty()
+                    bubble.caption("Encrypting transmission...")
                     response = ""
-                    last_error = ""
                     found_provider = False
                     
-                    # 1. Try AI Models
-                    for model in ['mistral-large', 'llama3-8b', 'gemma-7b']:
-                        try:
-                            # Standard execution
-                            q = f"SELECT SNOWFLAKE.CORTEX.COMPLETE('{model}', '{safe_prompt}') as response"
-                            response = session.sql(q).collect()[0]['RESPONSE']
-                            found_provider = True
-                            break
-                        except Exception as e: 
-                            last_error = str(e)
-                            continue
+                    # 1. Try AI Models (cascade lives in the backend)
+                    try:
+                        # Holds a CORTEX slot while tokens arrive; a busy warehouse falls through to the autonomous answer
+                        with governor.slot(governance.CORTEX, current_user(), session):
+                            for chunk in backend.stream(system_prompt):
+                                response += chunk
+                                bubble.markdown(response + "▌")
+                        found_provider = True
+                    except Exception as e:
+                        found_provider = bool(response) # Keep a partial answer rather than discarding it
                         
                     # 2. Smart Fallback
                     if not found_provider:
@@ -395,8 +579,8 @@ elif st.session_state.page == "Commander Chat":
                         except:
                              response = "Manual Override: Check Dashboard."
                     
-                    st.markdown(response)
-                    st.session_state.messages.append({"role": "assistant", "content": response})
+                    bubble.markdown(response)
+                    memory.append("assistant", response)
                     
                     # --- SERVER-SIDE VOICE (gTTS) ---
                     try:
@@ -421,6 +605,9 @@ elif st.session_state.page == "Commander Chat":
                         # This prevents the "Comms Failure" red box from appearing for a non-critical feature.
                         pass
 
+                    # Fold old turns into the summary only now, after the answer and audio are out
+                    memory.compact()
+
                 except Exception as e:
                     st.error(f"Comms Failure: {e}")
 
@@ -437,49 +624,29 @@ elif st.session_state.page == "AI Analyst":
         # Prepare context for AI
         try:
             # We aggregate the latest status for all items
-            latest_status = df.sort_values(by='DATE', ascending=True).groupby('ITEM_NAME').tail(1)
+            latest_status = get_latest(df)
             
              # FIX: Use to_string() instead of to_markdown() to avoid 'tabulate' dependency issues
             data_context = latest_status[['ITEM_NAME', 'STOCK_REMAINING', 'FORECAST_NEXT_7_DAYS']].to_string(index=False)
+            anomaly_str = anomaly_context(get_anomalies())
             
             st.markdown(f"**Analyzing {len(latest_status)} items...**")
             
+            # --- FEATURE 4: MARKETPLACE TOGGLE ---
+            # Rendered before the button so the choice is known when the briefing is generated
+            st.toggle("Include Weather Data (Marketplace)", key="include_weather", help="Uses weather-adjusted demand and lead times precomputed from the Marketplace Weather Feed.")
+            
             if st.button("Generate Executive Briefing", type="primary"):
                 with st.spinner("Analyzing patterns with Llama 3..."):
                     
-                    # --- FEATURE 4: MARKETPLACE TOGGLE ---
-                    st.toggle("Include Weather Data (Marketplace)", key="include_weather", help="Simulates connecting to a Live Snowflake Marketplace Weather Feed.")
-                    
                     # DYNAMIC PROMPT BASED ON SECTOR
                     current_sector = st.session_state.get('sector', 'Healthcare (Medicines)')
-                    
-                    if "Education" in current_sector:
-                        role = "Education Resource Planner"
-                        context_str = "school supplies (textbooks, meals)"
-                        impact = "Student Learning Outcomes"
-                        sim_risk_item = "Math Textbooks"
-                        sim_safe_item = "Notebooks"
-                    else:
-                        role = "NGO Supply Chain Analyst"
-                        context_str = "essential medicines"
-                        impact = "Patient Survival"
-                        sim_risk_item = "Antibiotics"
-                        sim_safe_item = "Bandages"
-
-                    prompt = f"""
-                    You are an expert {role}.
-                    Analyze the following data table representing inventory for {context_str}:
-                    
-                    {data_context}
-                    
-                    Produce a report in Markdown:
-                    1. ** Executive Summary**: Status of {impact}.
-                    2. ** 🚨 Critical Risks**: Items running out in < 7 days.
-                    3. ** ✅ Safe Items**: Items with good coverage.
-                    4. ** Recommended Actions**: 3 strategic moves.
-                    
-                    Be professional and use emojis.
-                    """
+                    profile = briefings.sector_profile(current_sector)
+                    sim_risk_item = profile['sim_risk_item']
+                    sim_safe_item = profile['sim_safe_item']
+
+                    # Same template as the daily batch, so both read alike
+                    prompt = briefings.analyst_prompt(current_sector, data_context, anomaly_str)
                     
                     safe_prompt = prompt.replace("'", "''")
                     try:
@@ -489,15 +656,15 @@ elif st.session_state.page == "AI Analyst":
                         weather_context = ""
                         if st.session_state.get('include_weather', False):
                             try:
-                                # Fetch simulated Marketplace Data
-                                weather_df = session.table("WEATHER_SAMPLE").to_pandas()
-                                weather_str = weather_df.to_string(index=False)
-                                weather_context = f"\n\nAdditional Context (Marketplace Data):\n{weather_str}\n\nFACTOR THIS WEATHER INTO YOUR LOGISTICS ADVICE."
+                                # Weather impact is precomputed per refresh (forecast_logic.weather_adjusted_horizon);
+                                # only the affected item-regions reach the prompt.
+                                weather_str = weather_impact_context()
+                                weather_context = f"\n\nWeather-adjusted outlook (Marketplace Data):\n{weather_str}\n\nFACTOR THIS WEATHER INTO YOUR LOGISTICS ADVICE."
                             except:
                                 weather_context = "\n\n(Weather Data Unavailable - Check Connection)"
 
                         query = f"SELECT SNOWFLAKE.CORTEX.COMPLETE('mistral-large', '{safe_prompt}{weather_context}') as response"
-                        response = session.sql(query).collect()[0]['RESPONSE']
+                        response = governor.sql(session, query, governance.CORTEX, current_user())[0]['RESPONSE']
                         
                         st.markdown("### 📝 Deployment Briefing")
                         
@@ -510,20 +677,7 @@ elif st.session_state.page == "AI Analyst":
                         st.divider()
                         st.subheader("⚡ Recommended Action")
                         if st.button("Draft Restock Notification Email"):
-                            email_draft = f"""
-Subject: Urgent Restock Request - {st.session_state.sector}
-
-Dear Supplier,
-
-Based on current consumption trends and forecasted demand, we require an immediate replenishment of the following critical items:
-
-{data_context}
-
-Please confirm delivery timeline by EOD.
-
-Sincerely,
-AidOps Logistics Team
-"""
+                            email_draft = briefings.restock_email(st.session_state.sector, data_context)
                             st.code(email_draft, language="text")
                             st.success("Draft created! Copy and send.")
 
@@ -533,7 +687,7 @@ AidOps Logistics Team
                             # 2. Fallback to Gemma 7b (Very lightweight)
                             st.warning("Retrying with lighter model...")
                             query_fallback = f"SELECT SNOWFLAKE.CORTEX.COMPLETE('gemma-7b', '{safe_prompt}') as response"
-                            response = session.sql(query_fallback).collect()[0]['RESPONSE']
+                            response = governor.sql(session, query_fallback, governance.CORTEX, current_user())[0]['RESPONSE']
                             st.markdown("### 📝 Deployment Briefing")
                             st.markdown(response)
                         except Exception as e_final:
@@ -563,6 +717,39 @@ AidOps Logistics Team
         except Exception as e:
              st.error(f"Error preparing AI Context: {e}")
 
+    # --- DAILY BRIEFINGS (precomputed per region and sector by briefings.py) ---
+    st.divider()
+    st.subheader("📬 Daily Briefings")
+    daily = get_daily_briefings()
+    if daily.empty:
+        st.info("No briefings generated today yet.")
+    else:
+        st.caption(f"{len(daily)} briefings generated at {daily['GENERATED_AT'].max()}")
+        b1, b2 = st.columns(2)
+        region = b1.selectbox("Region", sorted(daily['REGION'].unique()))
+        sector = b2.selectbox("Program", sorted(daily['SECTOR'].unique()))
+        pick = daily[(daily['REGION'] == region) & (daily['SECTOR'] == sector)]
+        if pick.empty or pick.iloc[0]['STATUS'] != "OK":
+            st.warning("Briefing failed for this region. Re-run the batch to retry.")
+        else:
+            st.markdown(pick.iloc[0]['BRIEFING'])
+            with st.expander("✉️ Restock Email Draft"):
+                st.code(pick.iloc[0]['EMAIL_DRAFT'], language="text")
+
+    if st.button("Run Daily Batch"):
+        with st.spinner("Drafting briefings for every region and program..."):
+            try:
+                if st.session_state.is_local:
+                    with governor.slot(governance.JOB, current_user(), session):
+                        res = briefings.main(session)
+                else:
+                    res = governor.sql(session, "CALL core.daily_briefings_proc()", governance.JOB, current_user())[0][0]
+                st.success(f"✅ {res}")
+            except governance.AdmissionError as e:
+                st.warning(f"Batch not started: {e}")
+            except Exception as e:
+                st.error(f"Batch Error: {e}")
+
 
 
 # ----------------- CONNECT DATA STRATEGY (Winning Feature: Dynamic Mapper) -----------------
@@ -571,22 +758,9 @@ elif st.session_state.page == "Connect Data":
     st.markdown("Link your existing Snowflake tables to the AidOps engine.")
     
     # --- FEATURE 1: DATA HEALTH MONITOR (Winning Feature: "Don't Hide Dirty Data") ---
-    if not st.session_state.is_local:
-         st.subheader("🩺 Data Health Monitor")
-         try:
-             # Quick audit of the connected table
-             health_df = session.table("RAPID_RELIEF_DB.CORE.INVENTORY_HISTORY").sample(n=100).to_pandas()
-             
-             cols = st.columns(4)
-             nulls = health_df.isnull().sum().sum()
-             negatives = (health_df.select_dtypes(include='number') < 0).sum().sum()
-             
-             cols[0].metric("Connection Status", "Active", "Online", delta_color="normal")
-             cols[1].metric("Data Quality Score", "92%", "-8% Issues", delta_color="inverse")
-             cols[2].metric("Null Values", int(nulls), "Requires Cleaning" if nulls > 0 else "Clean", delta_color="inverse")
-             cols[3].metric("Negative Stock", int(negatives), "Anomalies Found" if negatives > 0 else "Perfect", delta_color="inverse")
-         except:
-             st.warning("Connect a table to see health metrics.")
+    st.subheader("🩺 Data Health Monitor")
+    # Filled in below, once the input table is known
+    health_panel = st.container()
     
     st.divider()
     
@@ -594,12 +768,31 @@ elif st.session_state.page == "Connect Data":
         # LOCAL MODE: Manual Table Input
         # Default to the table created in setup
         input_table_reference = st.text_input("Local Table Name", value="RAPID_RELIEF_DB.CORE.INVENTORY_HISTORY")
+        weather_table_reference = st.text_input("Weather Table Name", value="WEATHER_SAMPLE")
         st.info("💻 Local Mode: Enter the name of the table in your connected Schema.")
     else:
         # NATIVE APP MODE: Reference
         input_table_reference = "reference('input_table')"
+        weather_table_reference = "reference('weather_table')"
         st.info(f"🔗 Connected Reference: `{input_table_reference}`")
     
+    with health_panel:
+        # Full-table profile precomputed in the warehouse (see data_quality.py), no sampling
+        health = data_quality.latest_quality_stats(session, input_table_reference)
+        if health is None:
+            st.warning("Connect a table and run the logic to see health metrics.")
+        else:
+            cols = st.columns(4)
+            nulls = int(health['NULL_QUANTITY'] + health['NULL_STOCK'])
+            negatives = int(health['NEGATIVE_STOCK'])
+            score = health['QUALITY_SCORE']
+
+            cols[0].metric("Rows Profiled", f"{int(health['ROW_COUNT']):,}", f"~{int(health['APPROX_DISTINCT_ITEMS'])} items", delta_color="off")
+            cols[1].metric("Data Quality Score", f"{score:.0f}%", f"-{100 - score:.0f}% Issues" if score < 100 else "Clean", delta_color="inverse" if score < 100 else "normal")
+            cols[2].metric("Null Values", nulls, "Requires Cleaning" if nulls > 0 else "Clean", delta_color="inverse")
+            cols[3].metric("Negative Stock", negatives, "Anomalies Found" if negatives > 0 else "Perfect", delta_color="inverse")
+            st.caption(f"{int(health['DUPLICATE_KEYS'])} duplicate (DATE, ITEM) keys · {int(health['DATE_GAPS'])} missing days · {health['REFRESH_MODE'].title()} scan at {health['COMPUTED_AT']}")
+    
     # --- SECTOR CONFIGURATION (Winning Feature: Multi-Industry Support) ---
     st.subheader("🏢 Industry Context")
     st.caption("Select the type of public program you are supporting.")
@@ -610,7 +803,7 @@ elif st.session_state.page == "Connect Data":
     # This ensures the Sidebar header updates instantly.
     st.selectbox(
         "Select Program Type", 
-        ["Healthcare (Medicines)", "Education (Textbooks/Meals)"], 
+        briefings.SECTORS, 
         key="sector",
         help="Switching this updates the AI Analyst and Dashboard labels instantly."
     )
@@ -625,28 +818,61 @@ elif st.session_state.page == "Connect Data":
             col_item = c2.selectbox("Item Name Column", columns, index=1)
             col_qty = c3.selectbox("Quantity Column", columns, index=3)
             
-            submit = st.form_submit_button("Run Logic & Update Cache")
+            method_options = list(forecast_logic.FORECAST_METHODS) + ["AUTO"]
+            forecast_method = st.selectbox(
+                "Forecast Method", method_options,
+                index=method_options.index(forecast_logic.DEFAULT_METHOD),
+                help="AUTO uses the most accurate method per item from the last backtest."
+            )
+            
+            b1, b2 = st.columns(2)
+            submit = b1.form_submit_button("Run Logic & Update Cache")
+            run_backtest = b2.form_submit_button("Run Backtest")
+            
+            if run_backtest:
+                with st.spinner("Scoring every method on rolling origins..."):
+                    try:
+                        if st.session_state.is_local:
+                            with governor.slot(governance.JOB, current_user(), session):
+                                res = backtest.main(session, input_table_reference, col_date, col_item, col_qty)
+                            st.success(f"✅ {res}")
+                        else:
+                            cmd = f"CALL core.backtest_proc('{input_table_reference}', '{col_date}', '{col_item}', '{col_qty}')"
+                            governor.sql(session, cmd, governance.JOB, current_user())
+                            st.success("✅ Backtest complete! Accuracy is shown on the Dashboard.")
+                    except governance.AdmissionError as e:
+                        st.warning(f"Backtest not started: {e}")
+                    except Exception as e:
+                        st.error(f"Backtest Error: {e}")
             
             if submit:
                 with st.spinner("Processing data..."):
                     if st.session_state.is_local:
                         # LOCAL MODE: Run Python directly (Bypass Stored Proc)
                         try:
-                            res = forecast_logic.main(
-                                session, 
-                                input_table_reference, 
-                                col_date, 
-                                col_item, 
-                                col_qty
-                            )
+                            with governor.slot(governance.JOB, current_user(), session):
+                                res = forecast_logic.main(
+                                    session, 
+                                    input_table_reference, 
+                                    col_date, 
+                                    col_item, 
+                                    col_qty,
+                                    forecast_method,
+                                    weather_table_reference
+                                )
                             st.success(f"✅ Logic updated locally! {res}")
+                        except governance.AdmissionError as e:
+                            st.warning(f"Forecast not started: {e}")
                         except Exception as e:
                             st.error(f"Local Logic Error: {e}")
                     else:
                         # NATIVE APP MODE: Call Stored Procedure
-                        cmd = f"CALL core.forecast_proc('{input_table_reference}', '{col_date}', '{col_item}', '{col_qty}')"
-                        session.sql(cmd).collect()
-                        st.success("✅ Logic updated! Check the Dashboard.")
+                        cmd = f"CALL core.forecast_proc('{input_table_reference}', '{col_date}', '{col_item}', '{col_qty}', '{forecast_method}')"
+                        try:
+                            governor.sql(session, cmd, governance.JOB, current_user())
+                            st.success("✅ Logic updated! Check the Dashboard.")
+                        except governance.AdmissionError as e:
+                            st.warning(f"Forecast not started: {e}")
                     
     except Exception as e:
         if st.session_state.is_local:
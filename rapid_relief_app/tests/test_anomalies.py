@@ -0,0 +1,92 @@
+import datetime
+
+import pytest
+
+snowpark = pytest.importorskip("snowflake.snowpark")
+
+import forecast_logic
+
+D = datetime.date
+
+# The sample ledger from scripts/data_setup.sql
+SAMPLE_ROWS = [
+    [D(2023, 10, 1), "Antibiotics", "North", 50, 500],
+    [D(2023, 10, 2), "Antibiotics", "North", 55, 445],
+    [D(2023, 10, 3), "Antibiotics", "North", None, 445],
+    [D(2023, 10, 4), "Antibiotics", "North", 65, 380],
+    [D(2023, 10, 5), "Antibiotics", "North", 70, 310],
+    [D(2023, 10, 6), "Antibiotics", "North", 80, 230],
+    [D(2023, 10, 7), "Antibiotics", "North", 90, 140],
+    [D(2023, 10, 8), "Antibiotics", "North", 95, 45],
+    [D(2023, 10, 9), "Antibiotics", "North", 100, -55],
+    [D(2023, 10, 1), "Bandages", "South", 20, 1000],
+    [D(2023, 10, 2), "Bandages", "South", 22, 978],
+    [D(2023, 10, 3), "Bandages", "South", 18, 960],
+    [D(2023, 10, 4), "Bandages", "South", 20, 940],
+    [D(2023, 10, 5), "Bandages", "South", None, 940],
+    [D(2023, 10, 6), "Bandages", "South", 25, 915],
+    [D(2023, 10, 7), "Bandages", "South", 20, 895],
+    [D(2023, 10, 1), "Rice Bags", "East", 100, 2000],
+    [D(2023, 10, 2), "Rice Bags", "East", 100, 1900],
+    [D(2023, 10, 3), "Rice Bags", "East", 120, 1780],
+    [D(2023, 10, 4), "Rice Bags", "East", 150, 1630],
+]
+
+
+@pytest.fixture(scope="module")
+def session():
+    s = snowpark.Session.builder.config("local_testing", True).create()
+    s.create_dataframe(SAMPLE_ROWS, schema=["DATE", "ITEM_NAME", "REGION", "QUANTITY_USED", "STOCK_REMAINING"]) \
+        .write.save_as_table("INVENTORY_HISTORY")
+
+    # One item without a region: steady 9/11 usage, an unrecorded restock on day 15 and a spike on day 20
+    rows, stock = [], 1000
+    for d in range(21):
+        used = 40 if d == 20 else (9 if d % 2 else 11)
+        stock -= used
+        if d == 15:
+            stock += 200
+        rows.append([D(2024, 1, 1) + datetime.timedelta(days=d), "Tents", used, stock])
+    s.create_dataframe(rows, schema=["DATE", "ITEM_NAME", "QUANTITY_USED", "STOCK_REMAINING"]) \
+        .write.save_as_table("LEDGER")
+    yield s
+    s.close()
+
+
+def _anomalies(session, table_name, **kwargs):
+    rows = forecast_logic.detect_anomalies(session, table_name, "DATE", "ITEM_NAME", "QUANTITY_USED", **kwargs).collect()
+    return {(r["DATE"], r["ITEM_NAME"], r["ANOMALY_TYPE"]): r for r in rows}
+
+
+def test_sample_data(session):
+    found = _anomalies(session, "INVENTORY_HISTORY")
+    assert set(found) == {
+        (D(2023, 10, 3), "Antibiotics", "MISSING_USAGE"),
+        (D(2023, 10, 5), "Bandages", "MISSING_USAGE"),
+        (D(2023, 10, 9), "Antibiotics", "NEGATIVE_STOCK"),
+    }
+    negative = found[(D(2023, 10, 9), "Antibiotics", "NEGATIVE_STOCK")]
+    assert negative["REGION"] == "North"
+    assert negative["OBSERVED"] == pytest.approx(-55)
+    assert negative["SCORE"] == pytest.approx(55)
+    assert found[(D(2023, 10, 3), "Antibiotics", "MISSING_USAGE")]["OBSERVED"] == pytest.approx(445)
+
+
+def test_stale_series(session):
+    # Rice Bags stops on 2023-10-04, five days before the latest date in the table
+    found = _anomalies(session, "INVENTORY_HISTORY", stale_days=3)
+    stale = {k: r for k, r in found.items() if k[2] == "STALE_SERIES"}
+    assert list(stale) == [(D(2023, 10, 4), "Rice Bags", "STALE_SERIES")]
+    assert stale[(D(2023, 10, 4), "Rice Bags", "STALE_SERIES")]["SCORE"] == pytest.approx(5)
+
+
+def test_ledger_mismatch_and_spike_without_region(session):
+    found = _anomalies(session, "LEDGER")
+    assert set(found) == {
+        (D(2024, 1, 16), "Tents", "LEDGER_MISMATCH"),
+        (D(2024, 1, 21), "Tents", "USAGE_SPIKE"),
+    }
+    mismatch = found[(D(2024, 1, 16), "Tents", "LEDGER_MISMATCH")]
+    assert mismatch["REGION"] is None
+    assert mismatch["OBSERVED"] - mismatch["EXPECTED"] == pytest.approx(200)
+    assert found[(D(2024, 1, 21), "Tents", "USAGE_SPIKE")]["SCORE"] > 3
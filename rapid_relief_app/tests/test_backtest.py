@@ -0,0 +1,54 @@
+import datetime
+
+import pytest
+
+snowpark = pytest.importorskip("snowflake.snowpark")
+
+import backtest
+
+
+@pytest.fixture(scope="module")
+def session():
+    s = snowpark.Session.builder.config("local_testing", True).create()
+    start = datetime.date(2024, 1, 1)
+    rows = []
+    for d in range(80):
+        day = start + datetime.timedelta(days=d)
+        rows.append([day, "FLAT", 10, 500])
+        rows.append([day, "TREND", d, 500]) # Grows by 1 a day, so the last value is the best predictor
+    s.create_dataframe(rows, schema=["DATE", "ITEM_NAME", "QUANTITY_USED", "STOCK_REMAINING"]) \
+        .write.save_as_table("INV")
+    yield s
+    s.close()
+
+
+def _scores(session, **kwargs):
+    rows = backtest.backtest(session, "INV", "DATE", "ITEM_NAME", "QUANTITY_USED", **kwargs).collect()
+    return {(r["ITEM_NAME"], r["METHOD"], r["HORIZON"]): r for r in rows}
+
+
+def test_one_row_per_item_method_and_horizon(session):
+    scores = _scores(session)
+    assert len(scores) == 2 * len(backtest.forecast_logic.FORECAST_METHODS) * 7
+    assert all(r["N_ORIGINS"] == 56 for r in scores.values())
+
+
+def test_flat_series_is_forecast_exactly(session):
+    scores = _scores(session, methods=["NAIVE", "MA7"])
+    for method in ("NAIVE", "MA7"):
+        for h in range(1, 8):
+            row = scores[("FLAT", method, h)]
+            assert row["MAE"] == pytest.approx(0)
+            assert row["BIAS"] == pytest.approx(0)
+            assert row["MAPE"] == pytest.approx(0)
+
+
+def test_trend_errors_and_best_method(session):
+    scores = _scores(session, methods=["NAIVE", "MA3"])
+    for h in range(1, 8):
+        # NAIVE forecasts today's value, which is h behind the actual; MA3 lags one more day
+        assert scores[("TREND", "NAIVE", h)]["MAE"] == pytest.approx(h)
+        assert scores[("TREND", "NAIVE", h)]["BIAS"] == pytest.approx(-h)
+        assert scores[("TREND", "MA3", h)]["MAE"] == pytest.approx(h + 1)
+        assert scores[("TREND", "NAIVE", h)]["IS_BEST"]
+        assert not scores[("TREND", "MA3", h)]["IS_BEST"]
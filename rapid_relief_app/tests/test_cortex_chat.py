@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+import cortex_chat
+import governance
+
+
+def _memory(**kwargs):
+    calls = []
+
+    def summarizer(text, max_chars):
+        calls.append(text)
+        return text[-max_chars:]
+
+    return cortex_chat.ChatMemory(summarizer=summarizer, **kwargs), calls
+
+
+def test_append_never_summarizes():
+    memory, calls = _memory(max_messages=4)
+    for i in range(8):
+        memory.append("user", f"message {i}.")
+    assert calls == []
+    assert len(memory.recent) == 8
+
+
+def test_compact_folds_half_the_ring_per_call():
+    memory, calls = _memory(max_messages=12)
+    for i in range(20):
+        memory.append("user", f"question {i}.")
+        memory.append("assistant", f"answer {i}.")
+        memory.compact()
+    assert len(calls) == 5
+    assert len(memory.recent) <= 12
+    assert memory.folded + len(memory.recent) == 40
+    assert memory.recent[-1]["content"] == "answer 19."
+
+
+def test_append_caps_ring_without_compact():
+    memory, calls = _memory(max_messages=4)
+    for i in range(30):
+        memory.append("user", f"message {i}.")
+    assert len(memory.recent) <= 8
+    assert memory.folded + len(memory.recent) == 30
+
+
+def test_failing_summarizer_falls_back_to_extractive():
+    def broken(text, max_chars):
+        raise RuntimeError("Cortex unavailable")
+
+    memory = cortex_chat.ChatMemory(max_messages=2, summarizer=broken)
+    for i in range(4):
+        memory.append("user", f"message {i}. more detail")
+    memory.compact()
+    assert "message 0." in memory.summary
+
+
+def test_cortex_summarizer_runs_through_run_sql():
+    governor = governance.Governor()
+    session = governance.FakeSession(rows=[{"SUMMARY": "user asked about stock levels"}])
+    summarize = cortex_chat.cortex_summarizer(
+        session, run_sql=lambda query: governor.sql(session, query, governance.CORTEX, "a"))
+    assert summarize("user: it's low", 10) == "user asked"
+    query, params = session.executed[0]
+    assert "CORTEX.SUMMARIZE('user: it''s low')" in query
+    assert params == governance.CORTEX.statement_params()
+
+
+class _ScriptedBackend(cortex_chat.CortexBackend):
+    """CortexBackend whose models are generators: model name -> list of chunks, delays (seconds) or errors."""
+
+    def __init__(self, script, timeout_s=None):
+        super().__init__(session=None, models=tuple(script), timeout_s=timeout_s)
+        self.script = script
+
+    def _stream_model(self, model, prompt):
+        for step in self.script[model]:
+            if isinstance(step, Exception):
+                raise step
+            if isinstance(step, float):
+                time.sleep(step)
+            else:
+                yield step
+
+
+def test_stream_fails_over_before_first_token():
+    backend = _ScriptedBackend({"broken": [RuntimeError("no access")], "ok": ["a ", "b"]})
+    assert list(backend.stream("hi")) == ["a ", "b"]
+    assert backend.model == "ok"
+
+
+def test_stream_bounds_wait_for_first_token():
+    backend = _ScriptedBackend({"hung": [5.0, "late"]}, timeout_s=0.2)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        list(backend.stream("hi"))
+    assert time.monotonic() - started < 2
+
+
+def test_stream_bounds_stall_between_chunks():
+    backend = _ScriptedBackend({"stalls": ["first ", 5.0, "late"]}, timeout_s=0.2)
+    received = []
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        for chunk in backend.stream("hi"):
+            received.append(chunk)
+    assert received == ["first "]
+    assert time.monotonic() - started < 2
@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+
+import governance
+
+# Short queue waits so the timeout paths stay fast
+FAST = governance.QueryClass("FAST", timeout_s=60, priority=0, queue_timeout_s=0.2)
+BATCH = governance.QueryClass("BATCH", timeout_s=60, priority=2, queue_timeout_s=0.2)
+CAPPED = governance.QueryClass("CAPPED", timeout_s=60, priority=1, max_concurrency=1, queue_timeout_s=0.2)
+
+
+class Holder:
+    """Holds one slot on a background thread until release() is called."""
+
+    def __init__(self, governor, query_class, user="anonymous"):
+        self.entered = threading.Event()
+        self._release = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, args=(governor, query_class, user), daemon=True)
+        self.thread.start()
+
+    def _run(self, governor, query_class, user):
+        try:
+            with governor.slot(query_class, user):
+                self.entered.set()
+                self._release.wait(5)
+        except governance.AdmissionError as e:
+            self.error = e
+
+    def release(self):
+        self._release.set()
+        self.thread.join(5)
+
+
+def test_class_cap_limits_concurrency():
+    governor = governance.Governor(global_limit=4, per_user_limit=4, reserved=0)
+    holder = Holder(governor, CAPPED, "a")
+    assert holder.entered.wait(5)
+    with pytest.raises(governance.AdmissionError):
+        with governor.slot(CAPPED, "b"):
+            pass
+    # Other classes still have room
+    with governor.slot(BATCH, "b"):
+        assert governor.running == 2
+    holder.release()
+    assert governor.running == 0
+
+
+def test_reserved_slot_admits_only_interactive():
+    governor = governance.Governor(global_limit=2, per_user_limit=4, reserved=1)
+    holder = Holder(governor, BATCH, "a")
+    assert holder.entered.wait(5)
+    with pytest.raises(governance.AdmissionError):
+        with governor.slot(BATCH, "b"):
+            pass
+    with governor.slot(FAST, "b"):
+        assert governor.running == 2
+    holder.release()
+
+
+def test_per_user_limit():
+    governor = governance.Governor(global_limit=4, per_user_limit=1, reserved=0)
+    holder = Holder(governor, BATCH, "a")
+    assert holder.entered.wait(5)
+    with pytest.raises(governance.AdmissionError, match="already has 1"):
+        with governor.slot(BATCH, "a"):
+            pass
+    with governor.slot(BATCH, "b"):
+        assert governor.in_flight_by_user == {"a": 1, "b": 1}
+    holder.release()
+    assert governor.in_flight_by_user == {}
+
+
+def test_queue_timeout_cleans_up():
+    governor = governance.Governor(global_limit=1, per_user_limit=4, reserved=0)
+    holder = Holder(governor, BATCH, "a")
+    assert holder.entered.wait(5)
+    with pytest.raises(governance.AdmissionError, match="waited"):
+        with governor.slot(BATCH, "b"):
+            pass
+    assert governor._waiting == []
+    assert "b" not in governor.in_flight_by_user
+    holder.release()
+    assert governor.running == 0
+    assert governor.in_flight_by_user == {}
+    assert sum(governor.running_by_class.values()) == 0
+
+
+def test_waiters_served_by_priority():
+    governor = governance.Governor(global_limit=1, per_user_limit=4, reserved=0)
+    holder = Holder(governor, BATCH, "a")
+    assert holder.entered.wait(5)
+    slow = governance.QueryClass("SLOW", timeout_s=60, priority=2, queue_timeout_s=5)
+    quick = governance.QueryClass("QUICK", timeout_s=60, priority=0, queue_timeout_s=5)
+    order = []
+
+    def wait_for(query_class, user):
+        with governor.slot(query_class, user):
+            order.append(query_class.name)
+
+    threads = []
+    for query_class, user in [(slow, "b"), (quick, "c")]:
+        thread = threading.Thread(target=wait_for, args=(query_class, user), daemon=True)
+        thread.start()
+        threads.append(thread)
+        while len(governor._waiting) < len(threads):
+            threading.Event().wait(0.01)
+    holder.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["QUICK", "SLOW"]
+
+
+def test_adhoc_cost_and_row_caps():
+    governor = governance.Governor()
+    costly = governance.FakeSession(scan_bytes=20 * 1024 ** 3)
+    with pytest.raises(governance.CostLimitError):
+        governor.sql(costly, "SELECT * FROM BIG", governance.ADHOC)
+    assert costly.executed == [] # Rejected at EXPLAIN, never run
+
+    wide = governance.FakeSession(rows=[(i,) for i in range(5000)])
+    rows = governor.sql(wide, "SELECT * FROM T", governance.ADHOC)
+    assert len(rows) == governance.ADHOC.max_rows
+    assert wide.executed[0][1] == governance.ADHOC.statement_params()
+
+
+def test_slot_with_session_sets_and_unsets_limits():
+    governor = governance.Governor()
+    session = governance.FakeSession()
+    with pytest.raises(RuntimeError):
+        with governor.slot(governance.INTERACTIVE, "a", session):
+            session.sql("SELECT 1").collect()
+            raise RuntimeError("chart failed")
+    queries = [query for query, _ in session.executed]
+    assert queries == [
+        governance.INTERACTIVE.session_sql(),
+        "SELECT 1",
+        "ALTER SESSION UNSET STATEMENT_TIMEOUT_IN_SECONDS, QUERY_TAG",
+    ]
+    assert governor.running == 0